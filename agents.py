@@ -2,9 +2,11 @@ import os
 import re
 import sys
 import json
+import time
 from tqdm import tqdm
 from concurrent.futures import ThreadPoolExecutor, as_completed
-from llm_api import chatapi
+import metrics
+from llm_api import achatapi, astream_chatapi, run_sync
 
 # helper
 
@@ -49,12 +51,68 @@ def format_history_like_dislike(like_items, dislike_items):
     
     return like_items, dislike_items
 
+def same_action(assistant_action, user_action):
+    # local accuracy rule: "dislike" appears in both actions or in neither
+    return ("dislike" in assistant_action.lower()) == ("dislike" in user_action.lower())
+
+def is_clear_action(action):
+    # the prediction starts with a plain Like/Dislike, so same_action can settle it without a critic
+    return re.match(r'\W*(dislike|like)\b', action, re.IGNORECASE) is not None
+
+def parse_structured(response, schema):
+    """(data, error): the JSON object in response checked against schema {key: str|list|bool}, error is None when valid"""
+    start, end = response.find("{"), response.rfind("}")
+    if start < 0 or end < start:
+        return None, "no JSON object"
+    text = response[start:end+1]    # drops ```json fences and any text around the object
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError:
+        try:
+            data = json.loads(re.sub(r',\s*([}\]])', r'\1', text))     # trailing commas
+        except json.JSONDecodeError as e:
+            return None, f"invalid JSON: {e}"
+    if not isinstance(data, dict):
+        return None, "not a JSON object"
+
+    for key, kind in schema.items():
+        if key not in data:
+            return None, f"missing key {key!r}"
+        value = data[key]
+        if kind is list:
+            if isinstance(value, str):
+                value = [value]
+            if not isinstance(value, list):
+                return None, f"{key!r} is not a list"
+            data[key] = [str(v).strip() for v in value if str(v).strip()]
+        elif kind is bool:
+            if isinstance(value, str) and value.strip().lower() in ("true", "false"):
+                value = value.strip().lower() == "true"
+            if not isinstance(value, bool):
+                return None, f"{key!r} is not true or false"
+            data[key] = value
+        else:
+            data[key] = str(value).strip()
+    return data, None
+
 class GeneralAgent():
-    def __init__(self, prompt_path, llm_args): # can be abstract
+    schema = None       # {key: type} of the structured response, None: the agent has no structured mode
+    stream = False
+
+    def __init__(self, prompt_path, llm_args, structured_prompt_path=None, max_repair=1, tiers=None): # can be abstract
         self.llm_args = llm_args
         self.sys_prompt_temp = load_prompt(prompt_path)
+        # model cascade, cheapest first: a call starts at the tier it is given and moves up while the answer does not parse
+        self.tiers = list(tiers) if tiers else [llm_args.get("model_name", "gpt-4")]
+        # structured: the response is one JSON object, parsed and validated in one pass;
+        # an invalid one is re-asked up to max_repair times before falling back to the text parser
+        self.structured_prompt = load_prompt(structured_prompt_path) if structured_prompt_path and self.schema else None
+        self.structured = self.structured_prompt is not None
+        self.max_repair = max_repair
     
     def render_sys_prompt(self):    
+        if self.structured:
+            return self.sys_prompt_temp + self.structured_prompt
         return self.sys_prompt_temp
 
     def render_human_prompt(self):
@@ -62,23 +120,112 @@ class GeneralAgent():
 
     def respond(self):
         raise NotImplementedError
+
+    async def arespond(self):
+        raise NotImplementedError
     
     def postprocess(self):
         raise NotImplementedError
 
+    def call_args(self, **overrides):
+        # llm_args of one call, labelled with the agent type in metrics
+        return {**self.llm_args, **overrides, "agent":type(self).__name__}
+
+    def is_parsed(self, result):
+        return True
+
+    def observe(self, result, model_name=None):
+        metrics.observe_parse(type(self).__name__, model_name or self.llm_args.get("model_name", "gpt-4"), self.is_parsed(result))
+        return result
+
+    def validate(self, data):
+        # agent specific check of a structured response, the error message or None
+        return None
+
+    def parse_structured(self, response):
+        data, error = parse_structured(response, self.schema)
+        if data is not None:
+            error = self.validate(data)
+        return (data, None) if error is None else (None, error)
+
+    async def arequest(self, sys_prompt, human_prompt, submitted=None, **overrides):
+        """(response, data): data is the validated JSON object in structured mode, None otherwise or when unrepaired"""
+        call_args = self.call_args(**overrides)
+        response = await achatapi(sys_prompt, human_prompt, submitted=submitted, **call_args)
+        if not self.structured:
+            return response, None
+        data, error = self.parse_structured(response)
+        for _ in range(self.max_repair):
+            if data is None:
+                # the failed answer counts as a parse failure, the re-ask only sends the error back
+                metrics.observe_parse(call_args["agent"], call_args.get("model_name", "gpt-4"), False)
+                metrics.observe_repair(call_args["agent"], call_args.get("model_name", "gpt-4"))
+                repair_prompt = (f"{human_prompt}\nYour previous answer:\n{response}\n"
+                                 f"It could not be used ({error}). Respond again with only the JSON object.")
+                response = await achatapi(sys_prompt, repair_prompt, **call_args)
+                data, error = self.parse_structured(response)
+        return response, data
+
+    def top_tier(self, tier=0):
+        return min(tier, len(self.tiers) - 1)
+
+    async def acomplete(self, sys_prompt, human_prompt, postprocess, tier=0, submitted=None, **overrides):
+        """Result of the first tier (from `tier` up) whose answer parses; postprocess(response, data) -> result
+
+        result["model"] is the model that answered.
+        """
+        tier = self.top_tier(tier)
+        while True:
+            model_name = self.tiers[tier]
+            call_overrides = {**overrides, "model_name":model_name}
+            if self.stream and not self.structured:
+                result = await self.astream_respond(sys_prompt, human_prompt, postprocess, **call_overrides)
+            else:
+                response, data = await self.arequest(sys_prompt, human_prompt, submitted=submitted, **call_overrides)
+                result = self.observe(postprocess(response, data), model_name)
+            if self.is_parsed(result) or tier == len(self.tiers) - 1:
+                result["model"] = model_name
+                return result
+            metrics.observe_escalation(type(self).__name__, model_name)
+            tier += 1
+
+    def complete(self, sys_prompt, human_prompt, postprocess, tier=0, **overrides):
+        return run_sync(self.acomplete(sys_prompt, human_prompt, postprocess, tier, submitted=time.time(), **overrides))
+
+    def is_decided(self, response):
+        # incremental parser for streaming: True once the partial response holds the decisive field
+        return False
+
+    async def astream_respond(self, sys_prompt, human_prompt, postprocess, **overrides):
+        # stop the stream at the decisive field, keep reading it in the background only for full logs
+        call_args = self.call_args(**overrides)
+        response, rest = await astream_chatapi(sys_prompt, human_prompt, until=self.is_decided,
+                                               keep_rest=self.keep_full_response, **call_args)
+        result = self.observe(postprocess(response, None), call_args.get("model_name"))
+        if rest is not None:
+            result["full_response"] = rest     # asyncio.Task -> complete text
+        return result
+
 # component agent
 class PerceiveAgent(GeneralAgent):
-    def __init__(self, prompt_path, llm_args):
-        super().__init__( prompt_path, llm_args)
+    def __init__(self, prompt_path, llm_args, tiers=None):
+        super().__init__( prompt_path, llm_args, tiers=tiers)
 
     def render_human_prompt(self, item):
         return f"Item: {item}"
 
-    def respond(self, item): 
+    def respond(self, item, tier=0): 
+        sys_prompt = self.render_sys_prompt()
+        human_prompt = self.render_human_prompt(item)
+        return self.complete(sys_prompt, human_prompt, lambda response, data: self.postprocess(item, response), tier)
+
+    async def arespond(self, item, tier=0):
         sys_prompt = self.render_sys_prompt()
         human_prompt = self.render_human_prompt(item)
-        response = chatapi(sys_prompt, human_prompt, **self.llm_args)
-        return self.postprocess(item, response)
+        return await self.acomplete(sys_prompt, human_prompt, lambda response, data: self.postprocess(item, response), tier)
+
+    def is_parsed(self, result):
+        return bool(str(result["item_information"]).strip())
 
     def postprocess(self, item, response):
         return {
@@ -87,8 +234,10 @@ class PerceiveAgent(GeneralAgent):
             }
 
 class LearnAgent(GeneralAgent):
-    def __init__(self, prompt_path, llm_args):
-        super().__init__(prompt_path, llm_args)
+    schema = {"prefer":list, "disprefer":list}
+
+    def __init__(self, prompt_path, llm_args, structured_prompt_path=None, tiers=None):
+        super().__init__(prompt_path, llm_args, structured_prompt_path, tiers=tiers)
     
     def render_human_prompt(self, item, item_information, user_action, user_comment=None, previous_learn=None):
         human_prompt = f"Item: {item}\nItem information: {item_information}\nUser Action:{user_action}\n"
@@ -98,19 +247,32 @@ class LearnAgent(GeneralAgent):
             human_prompt += f"Previous learn:{previous_learn}\n"
         return human_prompt
 
-    def respond(self, item, item_information, user_action, user_comment=None, previous_learn=None, **kwargs):
+    def respond(self, item, item_information, user_action, user_comment=None, previous_learn=None, llm_args=None, tier=0, **kwargs):
         sys_prompt = self.render_sys_prompt()
         human_prompt = self.render_human_prompt(item, item_information, user_action, user_comment, previous_learn)
-        response = chatapi(sys_prompt, human_prompt, **self.llm_args)
-        return self.postprocess(response, user_action)
+        return self.complete(sys_prompt, human_prompt, lambda response, data: self.postprocess(response, user_action, data),
+                             tier, **(llm_args or {}))
 
-    def postprocess(self, response, user_action):
-        prefer_pattern = r'\$\$ prefer:(.*?)(?:\n|$)'
-        disprefer_pattern = r'\$\$ disprefer:(.*?)(?:\n|$)'
-        prefer_matches = re.findall(prefer_pattern, response, re.DOTALL)
-        disprefer_matches = re.findall(disprefer_pattern, response, re.DOTALL)
-        user_prefer = list(match.strip() for match in prefer_matches)
-        user_disprefer = list(match.strip() for match in disprefer_matches)
+    async def arespond(self, item, item_information, user_action, user_comment=None, previous_learn=None, llm_args=None, tier=0, **kwargs):
+        # llm_args: per-call overrides, e.g. the temperature of one speculative chain
+        sys_prompt = self.render_sys_prompt()
+        human_prompt = self.render_human_prompt(item, item_information, user_action, user_comment, previous_learn)
+        return await self.acomplete(sys_prompt, human_prompt, lambda response, data: self.postprocess(response, user_action, data),
+                                    tier, **(llm_args or {}))
+
+    def is_parsed(self, result):
+        return bool(result["user_prefer"] or result["user_disprefer"])
+
+    def postprocess(self, response, user_action, data=None):
+        if data is not None:
+            user_prefer, user_disprefer = data["prefer"], data["disprefer"]
+        else:
+            prefer_pattern = r'\$\$ prefer:(.*?)(?:\n|$)'
+            disprefer_pattern = r'\$\$ disprefer:(.*?)(?:\n|$)'
+            prefer_matches = re.findall(prefer_pattern, response, re.DOTALL)
+            disprefer_matches = re.findall(disprefer_pattern, response, re.DOTALL)
+            user_prefer = list(match.strip() for match in prefer_matches)
+            user_disprefer = list(match.strip() for match in disprefer_matches)
 
         if "dislike" in user_action.lower():
             user_prefer = []
@@ -121,8 +283,15 @@ class LearnAgent(GeneralAgent):
 
 
 class ActionAgent(GeneralAgent):
-    def __init__(self, prompt_path, llm_args, with_personality=True):
-        super().__init__(prompt_path, llm_args)
+    schema = {"comment":str, "action":str}
+
+    def __init__(self, prompt_path, llm_args, with_personality=True, stream=False, keep_full_response=False,
+                 batch_prompt_path=None, structured_prompt_path=None, tiers=None):
+        super().__init__(prompt_path, llm_args, structured_prompt_path, tiers=tiers)
+        self.stream = stream
+        self.keep_full_response = keep_full_response
+        # slate format: several items share one system prompt and one prefer/disprefer block
+        self.batch_sys_prompt_temp = load_prompt(batch_prompt_path) if batch_prompt_path else None
 
     def render_human_prompt(self, item, item_information=None, 
                             user_prefer=None, user_disprefer=None):
@@ -137,14 +306,32 @@ class ActionAgent(GeneralAgent):
 
     
     def respond(self, item, item_information=None, 
-                            user_prefer=None, user_disprefer=None, **kwargs):
+                            user_prefer=None, user_disprefer=None, tier=0, **kwargs):
+        sys_prompt = self.render_sys_prompt()
+        human_prompt = self.render_human_prompt(item, item_information, user_prefer, user_disprefer)
+        return self.complete(sys_prompt, human_prompt, self.postprocess, tier)
+
+    async def arespond(self, item, item_information=None, 
+                            user_prefer=None, user_disprefer=None, tier=0, **kwargs):
         sys_prompt = self.render_sys_prompt()
         human_prompt = self.render_human_prompt(item, item_information, user_prefer, user_disprefer)
-        response = chatapi(sys_prompt, human_prompt, **self.llm_args)
-        return self.postprocess(response)
+        return await self.acomplete(sys_prompt, human_prompt, self.postprocess, tier)
+
+    def is_decided(self, response):
+        return re.search(r'User Action:\s*(dislike|like)\b', response, re.IGNORECASE) is not None
 
 
-    def postprocess(self, response):
+    def is_parsed(self, result):
+        return bool(result["action"])
+
+    def validate(self, data):
+        if not is_clear_action(data["action"]):
+            return "action must be Like or Dislike"
+        return None
+
+    def postprocess(self, response, data=None):
+        if data is not None:
+            return {"response":response, "comment":data["comment"], "action":data["action"]}
         comment_pattern = r'User Comment:(.*?)(?:\n|$)'   
         action_pattern = r'User Action:(.*?)(?:\n|$)'     
 
@@ -156,9 +343,56 @@ class ActionAgent(GeneralAgent):
 
         return {"response":response, "comment":comment, "action":action}
 
+    # slate of items in one call
+    def render_batch_human_prompt(self, items, user_prefer=None, user_disprefer=None):
+        # items: [{"item":..., "item_information":...}, ...]
+        user_prefer, user_disprefer = format_prefer_disprefer(user_prefer, user_disprefer)
+        human_prompt = f"User Prefer: \n{user_prefer}\nUser Disprefer: \n{user_disprefer}\nItems:\n"
+        for index, item in enumerate(items, 1):
+            human_prompt += f"[{index}] Item: {item['item']}\n"
+            if item.get("item_information"):
+                human_prompt += f"Item information: {item['item_information']}\n"
+        return human_prompt
+
+    def respond_batch(self, items, user_prefer=None, user_disprefer=None, **kwargs):
+        return run_sync(self.arespond_batch(items, user_prefer, user_disprefer, **kwargs))
+
+    async def arespond_batch(self, items, user_prefer=None, user_disprefer=None, **kwargs):
+        if self.batch_sys_prompt_temp is None:
+            raise ValueError("ActionAgent has no batch prompt, pass batch_prompt_path")
+        human_prompt = self.render_batch_human_prompt(items, user_prefer, user_disprefer)
+        response = await achatapi(self.batch_sys_prompt_temp, human_prompt, **self.call_args())
+        result = self.postprocess_batch(response, len(items))
+        metrics.observe_parse(type(self).__name__, self.llm_args.get("model_name", "gpt-4"), len(result["results"]) == len(items))
+        return result
+
+    def postprocess_batch(self, response, n_items):
+        # {"response":..., "results":{item position: {"action":..., "score":...}}}, unparsed positions are missing
+        line_pattern = r'^\W*\[?(\d+)\]?.*?User Action:\s*(dislike|like)\b'
+        score_pattern = r'Score:\s*(-?\d+(?:\.\d+)?)'
+
+        results = {}
+        for line in response.split("\n"):
+            line_match = re.search(line_pattern, line, re.IGNORECASE)
+            if line_match is None:
+                continue
+            position = int(line_match.group(1)) - 1
+            if position < 0 or position >= n_items or position in results:
+                continue
+            score_match = re.search(score_pattern, line)
+            results[position] = {
+                "action":line_match.group(2).capitalize(),
+                "score":float(score_match.group(1)) if score_match else None,
+            }
+        return {"response":response, "results":results}
+
 class CriticAgent(GeneralAgent):
-    def __init__(self, prompt_path, llm_args):
-        super().__init__(prompt_path, llm_args)
+    schema = {"accurate":bool, "reasons":list, "suggestions":list}
+
+    def __init__(self, prompt_path, llm_args, stream=False, keep_full_response=False, structured_prompt_path=None, tiers=None):
+        super().__init__(prompt_path, llm_args, structured_prompt_path, tiers=tiers)
+        self.stream = stream
+        self.keep_full_response = keep_full_response
 
     def render_human_prompt(self, user_prefer, user_disprefer,    
                             item, item_information, 
@@ -174,16 +408,36 @@ class CriticAgent(GeneralAgent):
 
     def respond(self, user_prefer, user_disprefer, 
                 item, item_information, 
-                prediction_action, groundtruth_action, **kwargs):
+                prediction_action, groundtruth_action, tier=0, **kwargs):
+        sys_prompt = self.render_sys_prompt()
+        human_prompt = self.render_human_prompt(
+                    user_prefer, user_disprefer, 
+                    item, item_information, 
+                    prediction_action, groundtruth_action)
+        return self.complete(sys_prompt, human_prompt, self.postprocess, tier)
+
+    async def arespond(self, user_prefer, user_disprefer, 
+                item, item_information, 
+                prediction_action, groundtruth_action, tier=0, **kwargs):
         sys_prompt = self.render_sys_prompt()
         human_prompt = self.render_human_prompt(
                     user_prefer, user_disprefer, 
                     item, item_information, 
                     prediction_action, groundtruth_action)
-        response = chatapi(sys_prompt, human_prompt, **self.llm_args)
-        return self.postprocess(response)
+        return await self.acomplete(sys_prompt, human_prompt, self.postprocess, tier)
+
+    def is_decided(self, response):
+        # only an accurate verdict is decisive, a wrong prediction still needs the reasons and suggestions
+        accurate = re.search(r'Accurate:(.*?)\n', response)
+        return accurate is not None and "True" in accurate.group(1)
+
+    def is_parsed(self, result):
+        return "True" in result["accurate"] or "False" in result["accurate"]
 
-    def postprocess(self, response):
+    def postprocess(self, response, data=None):
+        if data is not None:
+            return {"response":response, "accurate":str(data["accurate"]),
+                    "suggestions":"; ".join(data["suggestions"]), "reasons":"; ".join(data["reasons"])}
 
         accurate_pattern = r'Accurate:(.*?)(?:\n|$)'
         reason_pattern = r'\$\$ reason:(.*?)(?:\n|$)'
@@ -200,21 +454,32 @@ class CriticAgent(GeneralAgent):
         return {"response":response, "accurate":accurate, "suggestions":suggestions, "reasons":reasons}
 
 class ReflectAgent(GeneralAgent):
-    def __init__(self, prompt_path, llm_args):
-        super().__init__(prompt_path, llm_args)
+    schema = {"prefer":list, "disprefer":list}
+
+    def __init__(self, prompt_path, llm_args, structured_prompt_path=None, tiers=None):
+        super().__init__(prompt_path, llm_args, structured_prompt_path, tiers=tiers)
 
     def render_human_prompt(self,user_prefer, user_disprefer):
         user_prefer, user_disprefer = format_prefer_disprefer(user_prefer, user_disprefer)
         human_prompt = f"User Prefer: \n{user_prefer}\nUser Disprefer: \n{user_disprefer}\n"
         return human_prompt
 
-    def respond(self, user_prefer, user_disprefer, **kwargs):
+    def respond(self, user_prefer, user_disprefer, tier=0, **kwargs):
         sys_prompt = self.render_sys_prompt()
         human_prompt = self.render_human_prompt(user_prefer, user_disprefer)
-        response = chatapi(sys_prompt, human_prompt, **self.llm_args)
-        return self.postprocess(response)
+        return self.complete(sys_prompt, human_prompt, self.postprocess, tier)
 
-    def postprocess(self, response):
+    async def arespond(self, user_prefer, user_disprefer, tier=0, **kwargs):
+        sys_prompt = self.render_sys_prompt()
+        human_prompt = self.render_human_prompt(user_prefer, user_disprefer)
+        return await self.acomplete(sys_prompt, human_prompt, self.postprocess, tier)
+
+    def is_parsed(self, result):
+        return bool(result["user_prefer"] or result["user_disprefer"])
+
+    def postprocess(self, response, data=None):
+        if data is not None:
+            return {"response":response, "user_prefer":data["prefer"], "user_disprefer":data["disprefer"]}
         prefer_pattern = r'\$\$ prefer:(.*?)(?:\n|$)'
         disprefer_pattern = r'\$\$ disprefer:(.*?)(?:\n|$)'
         prefer_matches = re.findall(prefer_pattern, response, re.DOTALL)
@@ -234,26 +499,54 @@ class ReflectAgent(GeneralAgent):
 
         return {"response":response, "user_prefer":user_prefer, "user_disprefer":user_disprefer}
 
-def get_agents(prompt_dir):
+DEFAULT_MODEL = "gpt-4-0613"
+AGENT_NAMES = ["perceive", "learn", "action", "reflect", "critic"]
+
+def parse_tiers(specs):
+    """["action=gpt-3.5-turbo,gpt-4-0613", ...] -> {"action":["gpt-3.5-turbo", "gpt-4-0613"]}, "all=..." sets every agent"""
+    tiers = {}
+    for spec in specs or []:
+        name, models = spec.split("=", 1)
+        for agent_name in (AGENT_NAMES if name == "all" else [name]):
+            if agent_name not in AGENT_NAMES:
+                raise ValueError(f"unknown agent {agent_name!r} in cascade {spec!r}")
+            tiers[agent_name] = [model.strip() for model in models.split(",") if model.strip()]
+    return tiers
+
+def get_agents(prompt_dir, stream=False, keep_full_response=False, structured=False, tiers=None):
+    # stream: ActionAgent and CriticAgent return as soon as their decisive line is generated
+    # structured: Learn/Action/Critic/Reflect answer with the JSON object of <prompt>_json.txt (streaming is then off)
+    # tiers: {agent name: [models, cheapest first]}, agents not listed use DEFAULT_MODEL only
+
+    def structured_path(name):
+        path = os.path.join(prompt_dir, f"{name}_json.txt")
+        return path if structured and os.path.exists(path) else None
+
+    def agent_tiers(name):
+        return (tiers or {}).get(name) or [DEFAULT_MODEL]
 
     prompt_path = os.path.join(prompt_dir, "perceive.txt")
-    llm_args = {"model_name":"gpt-4-0613"}
-    perceive_agent = PerceiveAgent(prompt_path, llm_args)
+    llm_args = {"model_name":agent_tiers("perceive")[0]}
+    perceive_agent = PerceiveAgent(prompt_path, llm_args, tiers=agent_tiers("perceive"))
 
     prompt_path = os.path.join(prompt_dir, "learn.txt")
-    llm_args = {"model_name":"gpt-4-0613"}
-    learn_agent = LearnAgent(prompt_path, llm_args)
+    llm_args = {"model_name":agent_tiers("learn")[0]}
+    learn_agent = LearnAgent(prompt_path, llm_args, structured_prompt_path=structured_path("learn"), tiers=agent_tiers("learn"))
 
     prompt_path = os.path.join(prompt_dir, "action.txt")
-    llm_args = {"model_name":"gpt-4-0613"}
-    action_agent = ActionAgent(prompt_path, llm_args)
+    batch_prompt_path = os.path.join(prompt_dir, "action_batch.txt")
+    llm_args = {"model_name":agent_tiers("action")[0]}
+    action_agent = ActionAgent(prompt_path, llm_args, stream=stream, keep_full_response=keep_full_response,
+                               batch_prompt_path=batch_prompt_path if os.path.exists(batch_prompt_path) else None,
+                               structured_prompt_path=structured_path("action"), tiers=agent_tiers("action"))
 
     prompt_path = os.path.join(prompt_dir, "reflect.txt")
-    llm_args = {"model_name":"gpt-4-0613"}
-    reflect_agent = ReflectAgent(prompt_path, llm_args)
+    llm_args = {"model_name":agent_tiers("reflect")[0]}
+    reflect_agent = ReflectAgent(prompt_path, llm_args, structured_prompt_path=structured_path("reflect"), tiers=agent_tiers("reflect"))
 
     prompt_path = os.path.join(prompt_dir, "critic.txt")
-    llm_args = {"model_name":"gpt-4-0613"}
-    critic_agent = CriticAgent(prompt_path, llm_args)
+    llm_args = {"model_name":agent_tiers("critic")[0]}
+    critic_agent = CriticAgent(prompt_path, llm_args, stream=stream, keep_full_response=keep_full_response,
+                               structured_prompt_path=structured_path("critic"), tiers=agent_tiers("critic"))
 
     return perceive_agent, learn_agent, action_agent, reflect_agent, critic_agent
\ No newline at end of file
@@ -2,13 +2,20 @@ import os
 import re
 import sys
 import json
+import time
+import asyncio
 from tqdm import tqdm
 from concurrent.futures import ThreadPoolExecutor, as_completed
-from llm_api import chatapi
+from llm_api import chatapi, run_sync, get_background_loop, count_tokens
+from agents import format_prefer_disprefer, same_action, is_clear_action
+from similarity import StatementIndex, dedup_statements
+from metrics import MetricsRegistry, session_registry
+from utils import make_name
 
 class Assistant:
     def __init__(
-        self, perceive_agent, learn_agent, action_agent, reflect_agent, critic_agent, user_id, library=None):
+        self, perceive_agent, learn_agent, action_agent, reflect_agent, critic_agent, user_id, library=None,
+        personality_token_budget=None, local_critic=True, personality_top_k=None):
         self.set_agents(perceive_agent, learn_agent, action_agent, reflect_agent, critic_agent)
         self.prefer = []
         self.disprefer = []
@@ -18,15 +25,48 @@ class Assistant:
         self.user_id = user_id
         self.library = library
 
+        # token budget of prefer/disprefer in the action prompt, crossing it triggers a background reflect
+        self.personality_token_budget = personality_token_budget
+        self.reflect_future = None
+        self.reflected_tokens = 0
+        self.metrics = {"act_prompt_tokens":[], "auto_reflect":0, "speculative_chains":[], "critic":{"calls":0, "skipped":0},
+                        "reflect":{"calls":0, "skipped":0, "removed":0, "unparsed":0},
+                        "cascade":{"steps":0, "escalated":0, "attempts":{}}}    # attempts: learn-act-critic attempts per tier
+        self.llm_metrics = MetricsRegistry()    # LLM calls made by this assistant's operations
+        # settle clear agreements in the learn-act-critic loop without calling CriticAgent
+        self.local_critic = local_critic
+
+        # act prompts carry only the top-k prefer/disprefer statements closest to the item, None keeps all
+        self.personality_top_k = personality_top_k
+        self.prefer_index = StatementIndex()
+        self.disprefer_index = StatementIndex()
+
     # [low-level]
     def describe_item(self, item_id=None, item_name="", perceive_agent=None, log=True):
+        return run_sync(self.adescribe_item(item_id, item_name, perceive_agent, log))
+
+    async def adescribe_item(self, item_id=None, item_name="", perceive_agent=None, log=True):
+        self.bind_session_metrics()
         perceive_agent = perceive_agent or self.perceive_agent
         # process
         if item_name in self.library.item_dict:                          # reuse
             item_response = self.library.item_dict[item_name]
         else:
-            item_response = perceive_agent.respond(item = item_name)
-            self.library.save_item(item_id, item_name, item_response)    
+            # concurrent callers of one item_name share a single PerceiveAgent call
+            future, owner = self.library.claim_item(item_name)
+            if owner:
+                try:
+                    item_response = await perceive_agent.arespond(item = item_name)
+                    item_response.pop("model", None)
+                    self.library.save_item(item_id, item_name, item_response)
+                    future.set_result(item_response)
+                except BaseException as e:
+                    future.set_exception(e)
+                    raise
+                finally:
+                    self.library.release_item(item_name)
+            else:
+                item_response = await asyncio.wrap_future(future)
 
         if log:
             print("---Item----------------------------------------------------")
@@ -34,21 +74,88 @@ class Assistant:
 
         return item_response
 
-    def reflect(self, new_prefer, new_disprefer, log=True):
+    def history_items(self, user_id=None, groups=("learn", "proxy", "unseen"), domains=None):
+        # [(item_id, item_name)] of a user's history in library.history_dict, first occurrence of each name
+        history = self.library.history_dict[user_id or self.user_id]
+        items, seen = [], set()
+        for group in groups:
+            for domain, group_history in history[group].items():
+                if domains is not None and domain not in domains:
+                    continue
+                for h in group_history:
+                    item_name = make_name(h["title"], domain)
+                    if item_name not in seen:
+                        seen.add(item_name)
+                        items.append((h["asin"], item_name))
+        return items
+
+    def prefetch(self, user_id=None, groups=("learn", "proxy", "unseen"), domains=None, concurrency=8):
+        """Warm library.item_dict with the user's history items in the background, returns a concurrent Future"""
+        items = self.history_items(user_id, groups, domains)
+        return asyncio.run_coroutine_threadsafe(self.aprefetch(items, concurrency), get_background_loop())
+
+    async def aprefetch(self, items, concurrency=8):
+        self.bind_session_metrics()
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def describe_one(item_id, item_name):
+            if item_name in self.library.item_dict:
+                return False
+            async with semaphore:
+                await self.adescribe_item(item_id, item_name, log=False)
+            return True
+
+        described = await asyncio.gather(*[describe_one(item_id, item_name) for item_id, item_name in items],
+                                         return_exceptions=True)
+        failed = [e for e in described if isinstance(e, Exception)]
+        if failed:
+            print(f"prefetch: {len(failed)} of {len(items)} items failed, e.g. {failed[0]!r}")
+        return sum(d is True for d in described)
+
+    def reflect(self, new_prefer, new_disprefer, log=True, dedup=True):
+        return run_sync(self.areflect(new_prefer, new_disprefer, log, dedup))
+
+    async def areflect(self, new_prefer, new_disprefer, log=True, dedup=True):
+        self.bind_session_metrics()
         reflect_agent = self.reflect_agent
         one_record = self.get_record_tempelate(record_type = "reflect")
 
         # process
         process = []
-        user_prefer_candidate = self.prefer + new_prefer
-        user_disprefer_candidate =self.disprefer + new_disprefer
-        reflect_response = reflect_agent.respond(user_prefer_candidate, user_disprefer_candidate)
-        reflected_prefer, reflected_disprefer = reflect_response["user_prefer"], reflect_response["user_disprefer"]
-        reflect_log = reflect_response["response"]
+        exist_prefer, exist_disprefer = list(self.prefer), list(self.disprefer)
+        if dedup:
+            # near-duplicates are merged locally, the agent only sees distinct statements
+            kept_prefer, removed_exist_prefer = dedup_statements(exist_prefer)
+            kept_disprefer, removed_exist_disprefer = dedup_statements(exist_disprefer)
+            novel_prefer, removed_new_prefer = dedup_statements(new_prefer, kept_prefer)
+            novel_disprefer, removed_new_disprefer = dedup_statements(new_disprefer, kept_disprefer)
+            removed_prefer, removed_disprefer = removed_exist_prefer + removed_new_prefer, removed_exist_disprefer + removed_new_disprefer
+            self.metrics["reflect"]["removed"] += len(removed_prefer) + len(removed_disprefer)
+        else:
+            kept_prefer, kept_disprefer, novel_prefer, novel_disprefer = exist_prefer, exist_disprefer, new_prefer, new_disprefer
+            removed_prefer, removed_disprefer = [], []
+        user_prefer_candidate = kept_prefer + novel_prefer
+        user_disprefer_candidate = kept_disprefer + novel_disprefer
+
+        if (new_prefer or new_disprefer) and not (novel_prefer or novel_disprefer):
+            # everything new restates what is known, the deduplicated personality is the reflection
+            self.metrics["reflect"]["skipped"] += 1
+            reflected_prefer, reflected_disprefer = kept_prefer, kept_disprefer
+            reflect_log = "skipped: no novel statements after dedup"
+        else:
+            self.metrics["reflect"]["calls"] += 1
+            reflect_response = await reflect_agent.arespond(user_prefer_candidate, user_disprefer_candidate)
+            reflected_prefer, reflected_disprefer = reflect_response["user_prefer"], reflect_response["user_disprefer"]
+            reflect_log = reflect_response["response"]
+            if not reflect_agent.is_parsed(reflect_response):
+                # an unusable answer is not an empty personality, keep the deduplicated candidates
+                self.metrics["reflect"]["unparsed"] += 1
+                reflected_prefer, reflected_disprefer = user_prefer_candidate, user_disprefer_candidate
         process.append(
             {
-                "exist_personality":{"prefer":self.prefer, "disprefer":self.disprefer},
+                "exist_personality":{"prefer":exist_prefer, "disprefer":exist_disprefer},
                 "new_personality":{"prefer":new_prefer, "disprefer":new_disprefer},
+                "dedup":{"removed_prefer":removed_prefer, "removed_disprefer":removed_disprefer},
                 "log":{"reflect":reflect_log}
             }
         )
@@ -56,49 +163,68 @@ class Assistant:
             print("---Reflect----------------------------------------------------")
             print(reflect_log)
 
+        # statements added while the reflection was in flight are kept on top of its result
+        added_prefer = [prefer for prefer in self.prefer if prefer not in exist_prefer]
+        added_disprefer = [disprefer for disprefer in self.disprefer if disprefer not in exist_disprefer]
+
         # update
         one_record["process"] = process
-        if len(reflected_prefer)>=len(self.prefer)//5:
-            self.prefer = reflected_prefer
-            one_record["result"]["personality"]["prefer"] = reflected_prefer
+        if len(reflected_prefer)>=len(exist_prefer)//5:
+            self.prefer = reflected_prefer + added_prefer
         else: 
             # avoid incorrect reflection having extreme change
-            one_record["result"]["personality"]["prefer"] = self.prefer
             print("prfer too short")
+        one_record["result"]["personality"]["prefer"] = self.prefer
         
-        if len(reflected_disprefer)>=len(self.disprefer)//5:
-            self.disprefer = reflected_disprefer
-            one_record["result"]["personality"]["disprefer"] = reflected_disprefer
+        if len(reflected_disprefer)>=len(exist_disprefer)//5:
+            self.disprefer = reflected_disprefer + added_disprefer
         else:
             # avoid incorrect reflection having extreme change
-            one_record["result"]["personality"]["disprefer"] = self.disprefer
             print("disprefer too short")
+        one_record["result"]["personality"]["disprefer"] = self.disprefer
 
         
         self.record.append(one_record)
 
         return one_record
 
-    def act(self, item_id, item_name, user_action=None, prompt_path=None, log=True, save=True, **kwargs):
+    def act(self, item_id, item_name, user_action=None, prompt_path=None, log=True, save=True, top_k=None, **kwargs):
+        return run_sync(self.aact(item_id, item_name, user_action, prompt_path, log, save, top_k, **kwargs))
+
+    async def aact(self, item_id, item_name, user_action=None, prompt_path=None, log=True, save=True, top_k=None, **kwargs):
+        self.bind_session_metrics()
 
         perceive_agent = self.perceive_agent  
         action_agent = self.action_agent
         one_record = self.get_record_tempelate(record_type="act", item_id=item_id, item_name=item_name, item_info="", user_action="", user_comment="")
-        item_response = self.describe_item(item_id, item_name, perceive_agent, log)
+        item_response = await self.adescribe_item(item_id, item_name, perceive_agent, log)
+        self.check_personality_budget()
   
         # process
-        action_response = action_agent.respond(
+        user_prefer, user_disprefer = self.select_personality(item_response, top_k)
+        self.log_act_prompt_tokens(item_response, user_prefer, user_disprefer)
+        action_response = await action_agent.arespond(
                                     **item_response, 
-                                    user_prefer = self.prefer,
-                                    user_disprefer = self.disprefer)
+                                    user_prefer = user_prefer,
+                                    user_disprefer = user_disprefer)
 
         action_log = action_response.pop("response")
+        action_full = action_response.pop("full_response", None)
+        is_new = not self.library.record_dict["act"][self.user_id][item_id][user_action]
+        self.record_act(one_record, item_id, item_response, action_response["action"], action_log, user_action, log, save)
+        # the record is saved with the partial log, the full text is saved again once read
+        resave = (lambda: self.library.save_record("act", self.user_id, item_id, user_action, one_record, update=True)) \
+            if save and is_new else None
+        self.keep_full_log(action_full, one_record["process"][0]["log"], "action", on_update=resave)
+        return one_record
+
+
+    def record_act(self, one_record, item_id, item_response, action, action_log, user_action=None, log=True, save=True, score=None):
         # record
-        assistant_action = action_response["action"][:10]
+        assistant_action = action[:10]
         if user_action is not None:
             one_record["user_action"] = user_action
-            if ("dislike" in assistant_action.lower() and "dislike" in user_action.lower()) or \
-                ("dislike" not in assistant_action.lower() and "dislike" not in user_action.lower()):
+            if same_action(assistant_action, user_action):
                 accurate = "True"
             else:
                 accurate = "False"
@@ -122,13 +248,215 @@ class Assistant:
         one_record["item"]["information"] = item_response["item_information"]
         one_record["result"]["assistant_action"] = assistant_action
         one_record["result"]["accurate"] = accurate
+        if score is not None:
+            one_record["result"]["score"] = score
         self.record.append(one_record)
         if save:
             self.library.save_record("act", self.user_id, item_id, user_action, one_record)
         return one_record
 
+    def rank(self, items, slate_size=10, user_actions=None, concurrency=4, log=False, save=True):
+        return run_sync(self.arank(items, slate_size, user_actions, concurrency, log, save))
+
+    async def arank(self, items, slate_size=10, user_actions=None, concurrency=4, log=False, save=True):
+        """Act on [(item_id, item_name), ...] with slate_size items per ActionAgent call.
+
+        Every item gets a normal "act" record (with result["score"] when parsed); items missing from
+        a slate response fall back to a single-item act. Records are returned best first.
+        """
+        self.bind_session_metrics()
+        user_actions = user_actions or [None] * len(items)
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def describe_one(item_id, item_name):
+            async with semaphore:
+                return await self.adescribe_item(item_id, item_name, log=log)
+        item_responses = await asyncio.gather(*[describe_one(item_id, item_name) for item_id, item_name in items])
+        self.check_personality_budget()
+
+        async def rank_slate(start):
+            async with semaphore:
+                slate = item_responses[start:start+slate_size]
+                batch_response = await self.action_agent.arespond_batch(slate, self.prefer, self.disprefer)
+            records = []
+            for position in range(len(slate)):
+                item_id, item_name = items[start+position]
+                result = batch_response["results"].get(position)
+                if result is None:
+                    records.append(await self.aact(item_id, item_name, user_actions[start+position], log=log, save=save))
+                    continue
+                one_record = self.get_record_tempelate(record_type="act", item_id=item_id, item_name=item_name, item_info="", user_action="", user_comment="")
+                records.append(self.record_act(one_record, item_id, slate[position], result["action"], batch_response["response"],
+                                               user_actions[start+position], log, save, result["score"]))
+            return records
+
+        slates = await asyncio.gather(*[rank_slate(start) for start in range(0, len(items), slate_size)])
+        records = [record for slate in slates for record in slate]
+
+        def rank_key(record):
+            # unscored fallback items rank below the scored ones with the same action
+            score = record["result"].get("score")
+            liked = "dislike" not in record["result"]["assistant_action"].lower()
+            return (liked, score is not None, score if score is not None else 0)
+        return sorted(records, key=rank_key, reverse=True)
+
+    def keep_full_log(self, full_response, log, key, on_update=None, full_logs=None):
+        # streaming agents answer at the decisive field, the complete text replaces the partial log once read;
+        # on_update() runs after the replacement (e.g. re-saving a record that was already saved),
+        # full_logs collects (task, log, key) for callers that await the full text before saving
+        if full_response is None:
+            return
+        def update(task):
+            if not task.cancelled() and task.exception() is None:
+                log[key] = task.result()
+                if on_update is not None:
+                    on_update()
+        full_response.add_done_callback(update)
+        if full_logs is not None:
+            full_logs.append((full_response, log, key))
+
+    async def await_full_logs(self, full_logs, process):
+        # complete the logs of the process entries about to be saved, dropped (cancelled) chains are not waited for
+        pending = [(task, log, key) for task, log, key in full_logs if any(log is one_process.get("log") for one_process in process)]
+        await asyncio.gather(*[task for task, _, _ in pending], return_exceptions=True)
+        for task, log, key in pending:
+            if not task.cancelled() and task.exception() is None:
+                log[key] = task.result()
+
+    async def arun_chain(self, index, item_response, user_action, user_comment=None, previous_learn=None, log=True,
+                         learn_llm_args=None, tier=0, full_logs=None, **kwargs):
+        """One learn -> act -> critic attempt, returns its process entry and the previous_learn for a retry"""
+        learn_agent, action_agent, critic_agent = self.learn_agent, self.action_agent, self.critic_agent
+        # tier: model of learn and act in their cascades, the critic starts at its cheapest model
+        # counted at the tier the agents start at, acomplete clamps the attempt's tier to the top of each cascade
+        used_tier = max(learn_agent.top_tier(tier), action_agent.top_tier(tier))
+        self.metrics["cascade"]["attempts"][used_tier] = self.metrics["cascade"]["attempts"].get(used_tier, 0) + 1
+        # (1) learn
+        learn_response = await learn_agent.arespond(**item_response, user_action=user_action, user_comment=user_comment, 
+                                                previous_learn=previous_learn, llm_args=learn_llm_args, tier=tier, **kwargs)
+        new_user_prefer = learn_response["user_prefer"]
+        new_user_disprefer = learn_response["user_disprefer"]
+        learn_log = learn_response.pop("response")
+        models = {"learn":learn_response.pop("model"), "action":None, "critic":None}     # models that answered
+        if log:
+            print(f"---Learn {index}----------------------------------------------------")
+            print(learn_log)
 
-    def step_learn_act_critic(self, item_id, item_name, user_action, user_comment=None, max_try_times=2, log=True, save=True, **kwargs):
+        # (2) act
+        action_response = await action_agent.arespond(**item_response, **learn_response, tier=tier,
+                                                user_history_like=None, user_history_dislike=None, **kwargs)   # without history in this loop
+        action_log = action_response.pop("response")
+        action_full = action_response.pop("full_response", None)
+        models["action"] = action_response.pop("model")
+        if log:
+            print(f"---Action {index}----------------------------------------------------")
+            print(action_log)
+
+        # (3) critic, a clear agreement is settled locally, CriticAgent only explains wrong predictions
+        if self.local_critic and is_clear_action(action_response["action"]) and \
+                same_action(action_response["action"][:10], user_action):
+            self.metrics["critic"]["skipped"] += 1
+            critic_response = {"accurate":"True", "reasons":"", "suggestions":""}
+            critic_log, critic_full = "local: prediction agrees with groundtruth", None
+        else:
+            self.metrics["critic"]["calls"] += 1
+            critic_response = await critic_agent.arespond(prediction_action=action_response["action"],
+                                                    groundtruth_action=user_action,
+                                                    **item_response, **learn_response)
+            critic_log = critic_response.pop("response")
+            critic_full = critic_response.pop("full_response", None)
+            models["critic"] = critic_response.pop("model")
+        if log:
+            print(f"---Critic {index}----------------------------------------------------")
+            print(critic_log)
+        
+        accurate = critic_response["accurate"]
+        reasons = critic_response["reasons"]
+        suggestions = critic_response["suggestions"]
+        previous_learn = self.get_previous_learn(new_user_prefer, new_user_disprefer, action_response["action"], reasons, suggestions)
+        
+        # (4) record process
+        one_process = {
+            "index":index,
+            "new_personality":{"prefer":new_user_prefer, "disprefer":new_user_disprefer},
+            "assistant_action":action_response["action"],
+            "accurate":accurate,
+            "suggestion":suggestions,
+            "reasons":reasons,
+            "tier":tier,
+            "models":models,
+            "status":"finished",
+            "log":{ "learn":learn_log, "action":action_log, "critic":critic_log }
+        }
+        self.keep_full_log(action_full, one_process["log"], "action", full_logs=full_logs)
+        self.keep_full_log(critic_full, one_process["log"], "critic", full_logs=full_logs)
+        return one_process, previous_learn
+
+    async def aspeculate_chains(self, speculative, temperatures, item_response, user_action, user_comment=None, log=True, **kwargs):
+        """Run `speculative` chains with different learn temperatures, the first accurate one wins.
+
+        Chains still running at that point are cancelled. process holds one entry per chain: cancelled and failed
+        chains first (status "cancelled" / "error", by chain index), then the finished ones in completion order,
+        so the winner (or the last failure) is process[-1].
+        """
+        temperatures = temperatures or [round(0.3 + 0.6 * k / (speculative - 1), 2) for k in range(speculative)]
+        tasks = [
+            asyncio.create_task(self.arun_chain(k, item_response, user_action, user_comment, None, log,
+                                                learn_llm_args={"temperature":temperature}, **kwargs))
+            for k, temperature in enumerate(temperatures)
+        ]
+        finished, previous_learn = [], None
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                try:
+                    one_process, previous_learn = await next_done
+                except Exception as e:
+                    print(f"Speculative chain failed: {e!r}")
+                    continue
+                finished.append(one_process)
+                if "True" in one_process["accurate"]:
+                    break
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        stopped, cancelled = [], []
+        for k, (task, temperature) in enumerate(zip(tasks, temperatures)):
+            if task.cancelled():
+                stopped.append(self.stopped_chain(k, "cancelled"))
+                cancelled.append(temperature)
+            elif task.exception() is not None:
+                stopped.append(self.stopped_chain(k, "error", repr(task.exception())))
+            elif task.result()[0] not in finished:
+                finished.insert(0, task.result()[0])     # completed together with the winner
+        if not finished:
+            errors = [task.exception() for task in tasks if not task.cancelled() and task.exception() is not None]
+            raise errors[0] if errors else RuntimeError("every speculative chain was cancelled")
+        process = stopped + finished
+        for one_process in process:
+            one_process["temperature"] = temperatures[one_process["index"]]
+        self.metrics["speculative_chains"].append({"chains":len(tasks), "finished":len(finished), "cancelled":cancelled,
+                                                   "success":"True" in finished[-1]["accurate"]})
+        return process, previous_learn
+
+    def stopped_chain(self, index, status, error=None):
+        # process entry of a chain that did not finish, same keys as a finished one
+        return {"index":index, "status":status, "error":error, "new_personality":None, "assistant_action":None,
+                "accurate":None, "suggestion":None, "reasons":None, "tier":0,
+                "models":{"learn":None, "action":None, "critic":None}, "log":None}
+
+    def step_learn_act_critic(self, item_id, item_name, user_action, user_comment=None, max_try_times=2, log=True, save=True,
+                              speculative=None, speculative_temperatures=None, **kwargs):
+        return run_sync(self.astep_learn_act_critic(item_id, item_name, user_action, user_comment, max_try_times, log, save,
+                                                    speculative, speculative_temperatures, **kwargs))
+
+    async def astep_learn_act_critic(self, item_id, item_name, user_action, user_comment=None, max_try_times=2, log=True, save=True,
+                                     speculative=None, speculative_temperatures=None, **kwargs):
+        self.bind_session_metrics()
+        # speculative: number of learn-act-critic chains started at once, each with its own learn temperature
+        if speculative and speculative > 1 and speculative_temperatures and len(speculative_temperatures) != speculative:
+            raise ValueError(f"{len(speculative_temperatures)} speculative_temperatures for {speculative} chains")
 
         is_new = False
         # used agents
@@ -146,69 +474,50 @@ class Assistant:
             one_record = self.get_record_tempelate(record_type="learn-act-critic", item_id=item_id, item_name=item_name, 
                                                         user_action=user_action, user_comment=user_comment)
             # item
-            item_response = self.describe_item(item_id, item_name, perceive_agent)
+            item_response = await self.adescribe_item(item_id, item_name, perceive_agent)
 
             # learn-act-critic process
-            (index, previous_learn, process) = (-1, None, [])
-            while True:
+            (index, previous_learn, process, stop_reason) = (-1, None, [], None)
+            full_logs = []      # streamed responses still being read, awaited before the record is saved
+            if speculative and speculative > 1:
+                # K chains at once, the sequential refinement below only runs if none is accurate
+                process, previous_learn = await self.aspeculate_chains(speculative, speculative_temperatures, item_response,
+                                                                       user_action, user_comment, log, full_logs=full_logs, **kwargs)
+                index = len(process) - 1    # one entry per chain, chain k has index k, refinements continue after the last one
+                if "True" in process[-1]["accurate"]:
+                    stop_reason = "success"
+                    print("Critic Success!")
+                elif max_try_times == 0:
+                    stop_reason = "max_try"
+            last_index = index + max_try_times + (0 if process else 1)
+            tier = 1 if process else 0      # every attempt after an inaccurate one runs one tier up the cascade
+            while stop_reason is None:
                 index += 1
-                # (1) learn
-                learn_response = learn_agent.respond(**item_response, user_action=user_action, user_comment=user_comment, 
-                                                        previous_learn=previous_learn, **kwargs)
-                new_user_prefer = learn_response["user_prefer"]
-                new_user_disprefer = learn_response["user_disprefer"]
-                learn_log = learn_response.pop("response")
-                if log:
-                    print(f"---Learn {index}----------------------------------------------------")
-                    print(learn_log)
-
-                # (2) act
-                action_response = action_agent.respond(**item_response, **learn_response, 
-                                                        user_history_like=None, user_history_dislike=None, **kwargs)   # without history in this loop
-                action_log = action_response.pop("response")
-                if log:
-                    print(f"---Action {index}----------------------------------------------------")
-                    print(action_log)
-
-                # (3) critic
-                critic_response = critic_agent.respond(prediction_action=action_response["action"],
-                                                        groundtruth_action=user_action,
-                                                        **item_response, **learn_response)
-                critic_log = critic_response.pop("response")
-                if log:
-                    print(f"---Critic {index}----------------------------------------------------")
-                    print(critic_log)
-                
-                accurate = critic_response["accurate"]
-                reasons = critic_response["reasons"]
-                suggestions = critic_response["suggestions"]
-                previous_learn = self.get_previous_learn(new_user_prefer, new_user_disprefer, action_response["action"], reasons, suggestions)
-                
-                # (4) record process
-                process.append(
-                    {
-                        "index":index,
-                        "new_personality":{"prefer":new_user_prefer, "disprefer":new_user_disprefer},
-                        "assistant_action":action_response["action"],
-                        "accurate":accurate,
-                        "suggestion":suggestions,
-                        "reasons":reasons,
-                        "log":{ "learn":learn_log, "action":action_log, "critic":critic_log }
-                    }
-                )
-                if "True" in accurate:
+                one_process, previous_learn = await self.arun_chain(index, item_response, user_action, user_comment,
+                                                                    previous_learn, log, tier=tier, full_logs=full_logs, **kwargs)
+                process.append(one_process)
+                if "True" in one_process["accurate"]:
                     stop_reason = "success"
                     print("Critic Success!")
                     break
-                if index >= max_try_times:
+                if index >= last_index:
                     stop_reason = "max_try"
                     print("Reach max try!")
                     break
+                tier += 1
+            new_user_prefer = process[-1]["new_personality"]["prefer"]
+            new_user_disprefer = process[-1]["new_personality"]["disprefer"]
+
+            self.metrics["cascade"]["steps"] += 1
+            if any(self.escalated(one_process) for one_process in process):
+                self.metrics["cascade"]["escalated"] += 1
 
             # update state
             one_record["item"]["information"] = item_response["item_information"]
             one_record["process"] = process
             one_record["stop_reason"] = stop_reason
+            if full_logs:
+                await self.await_full_logs(full_logs, process)
 
         prefer_candidate = self.prefer + [new_user_prefer]
         disprefer_candidate = self.disprefer + [new_user_disprefer]
@@ -238,7 +547,8 @@ class Assistant:
             # 2.1 indirect reuse
             if self.library.record_dict["learn-act-critic"][self.user_id][item_id][user_action]:
                 one_record = self.library.record_dict["learn-act-critic"][self.user_id][item_id][user_action]  
-                process = one_record["process"][:1]
+                # first attempt that learned something, cancelled or failed speculative chains did not
+                process = [one_process for one_process in one_record["process"] if one_process["new_personality"] is not None][:1]
                 new_user_prefer = process[0]["new_personality"]["prefer"]
                 new_user_disprefer = process[0]["new_personality"]["disprefer"]
 
@@ -294,7 +604,124 @@ class Assistant:
         return one_record            
 
 
+    def learn_batch(self, items, concurrency=4, update=False, log=False, save=True, **kwargs):
+        return run_sync(self.alearn_batch(items, concurrency, update, log, save, **kwargs))
+
+    async def alearn_batch(self, items, concurrency=4, update=False, log=False, save=True, **kwargs):
+        """Run step_learn_act_critic over independent items concurrently, records keep the input order"""
+        self.bind_session_metrics()
+        # items: [{"item_id":..., "item_name":..., "user_action":..., "user_comment":...}, ...]
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def learn_one(item):
+            async with semaphore:
+                return await self.astep_learn_act_critic(**item, log=log, save=save, **kwargs)
+
+        records = await asyncio.gather(*[learn_one(item) for item in items])
+
+        if update:
+            self.update_personality(*self.merge_new_personality(records))
+
+        return list(records)
+
+    # personality budget
+    def update_personality(self, new_prefer, new_disprefer):
+        self.prefer = self.prefer + [p for p in new_prefer if p not in self.prefer]
+        self.disprefer = self.disprefer + [d for d in new_disprefer if d not in self.disprefer]
+        self.check_personality_budget()
+
+    def personality_tokens(self):
+        user_prefer, user_disprefer = format_prefer_disprefer(self.prefer, self.disprefer)
+        return count_tokens(f"{user_prefer}\n{user_disprefer}", self.action_agent.llm_args.get("model_name", "gpt-4"))
+
+    def check_personality_budget(self):
+        if self.personality_token_budget is None:
+            return None
+        if self.reflect_future is not None and not self.reflect_future.done():
+            return self.reflect_future
+        tokens = self.personality_tokens()
+        # re-reflect only when something was learned since the last consolidation
+        if tokens <= self.personality_token_budget or tokens <= self.reflected_tokens:
+            return None
+
+        self.metrics["auto_reflect"] += 1
+        self.reflect_future = asyncio.run_coroutine_threadsafe(self.aconsolidate_personality(), get_background_loop())
+        return self.reflect_future
+
+    async def aconsolidate_personality(self):
+        one_record = await self.areflect([], [], log=False)
+        self.reflected_tokens = self.personality_tokens()
+        return one_record
+
+    def select_personality(self, item_response, top_k=None):
+        top_k = top_k if top_k is not None else self.personality_top_k
+        if top_k is None:
+            return self.prefer, self.disprefer
+        # the indexes follow self.prefer/self.disprefer, only statements added since the last act are embedded
+        self.prefer_index.sync(self.prefer)
+        self.disprefer_index.sync(self.disprefer)
+        query = f"{item_response['item']}\n{item_response['item_information']}"
+        return self.prefer_index.top_k(query, top_k), self.disprefer_index.top_k(query, top_k)
+
+    def log_act_prompt_tokens(self, item_response, user_prefer=None, user_disprefer=None):
+        model_name = self.action_agent.llm_args.get("model_name", "gpt-4")
+        if user_prefer is None and user_disprefer is None:
+            user_prefer, user_disprefer = self.prefer, self.disprefer
+        human_prompt = self.action_agent.render_human_prompt(item_response["item"], item_response["item_information"],
+                                                             user_prefer, user_disprefer)
+        prompt_tokens = count_tokens(self.action_agent.render_sys_prompt(), model_name) + count_tokens(human_prompt, model_name)
+        self.metrics["act_prompt_tokens"].append({"time":time.time(), "prompt_tokens":prompt_tokens})
+        return prompt_tokens
+
+    def bind_session_metrics(self):
+        # LLM calls awaited by the current task (and the tasks it starts) are also counted in self.llm_metrics
+        session_registry.set(self.llm_metrics)
+
+    def session_summary(self):
+        llm = self.llm_metrics.summary()
+        return {
+            "user_id":self.user_id,
+            "llm":llm,
+            "calls":sum(row["calls"] for row in llm),
+            "prompt_tokens":sum(row["prompt_tokens"] for row in llm),
+            "completion_tokens":sum(row["completion_tokens"] for row in llm),
+            "critic":self.critic_stats(),
+            "reflect":dict(self.metrics["reflect"]),
+            "auto_reflect":self.metrics["auto_reflect"],
+            "cascade":self.cascade_stats(),
+        }
+
+    def escalated(self, one_process):
+        # an attempt escalated when any of its agents was answered by a model above its cheapest tier,
+        # after a critic failure or after an unparsable answer
+        agents = {"learn":self.learn_agent, "action":self.action_agent, "critic":self.critic_agent}
+        return any(model is not None and model != agents[name].tiers[0]
+                   for name, model in one_process.get("models", {}).items())
+
+    def cascade_stats(self):
+        cascade = self.metrics["cascade"]
+        return {**cascade, "attempts":dict(cascade["attempts"]),
+                "escalation_rate":cascade["escalated"] / cascade["steps"] if cascade["steps"] else 0.0}
+
+    def critic_stats(self):
+        critic = self.metrics["critic"]
+        checks = critic["calls"] + critic["skipped"]
+        return {**critic, "skipped_fraction":critic["skipped"] / checks if checks else 0.0}
+
     # 4. helper
+    def merge_new_personality(self, records):
+        # merged in record order and de-duplicated, so the result does not depend on completion order
+        new_prefer, new_disprefer = [], []
+        for record in records:
+            new_personality = record["result"]["new_personality"]
+            for prefer in new_personality.get("prefer", []):
+                if prefer not in new_prefer:
+                    new_prefer.append(prefer)
+            for disprefer in new_personality.get("disprefer", []):
+                if disprefer not in new_disprefer:
+                    new_disprefer.append(disprefer)
+        return new_prefer, new_disprefer
+
     def get_previous_learn(self, previous_prefer, previous_disprefer, previous_action, reasons, suggestions):
         previous_learn = f"Previous Prefer: {previous_prefer}\n"
         previous_learn+= f"Previous Disprefer: {previous_disprefer}\n" 
@@ -0,0 +1,195 @@
+import os
+import json
+import time
+import shutil
+import asyncio
+import argparse
+import platform
+import resource
+import tempfile
+import tracemalloc
+import subprocess
+import numpy as np
+import llm_api
+import metrics
+from agents import get_agents, parse_tiers
+from assistant import Assistant
+from library import Library
+from llm_api import run_sync
+from mock_server import MockServer, MockConfig, use_mock_server
+
+# Throughput and memory of the pipeline against the local mock server (no API cost).
+# Every phase runs its operations under an asyncio.Semaphore(concurrency); results are appended to a
+# JSON-lines file, one line per run, and --compare prints the ratios against an earlier run.
+
+def git_label():
+    try:
+        return subprocess.check_output(["git", "describe", "--always", "--dirty"], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def make_library(library_dir, history_dir, **kwargs):
+    paths = [os.path.join(library_dir, name) for name in ["item", "record", "personality"]]
+    for path in paths:
+        os.makedirs(path, exist_ok=True)
+    return Library(*paths, history_dir, record_types=["learn-act-critic", "act"], **kwargs)
+
+def summarize(phase, concurrency, latencies, seconds, peak_bytes, calls):
+    latencies = np.array(latencies) if latencies else np.zeros(1)
+    return {
+        "phase":phase, "concurrency":concurrency, "ops":len(latencies), "seconds":seconds,
+        "ops_per_sec":len(latencies) / seconds if seconds > 0 else 0.0,
+        "p50":float(np.percentile(latencies, 50)), "p95":float(np.percentile(latencies, 95)),
+        "peak_mb":peak_bytes / 2**20, "llm_calls":calls,
+    }
+
+async def timed_ops(ops, concurrency):
+    # ops: coroutine factories, returns per-op latencies
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def run_one(op):
+        async with semaphore:
+            start = time.time()
+            await op()
+            latencies.append(time.time() - start)
+
+    await asyncio.gather(*[run_one(op) for op in ops])
+    return latencies
+
+def run_phase(phase, concurrency, ops):
+    calls = llm_api.call_stats["calls"]
+    tracemalloc.start()
+    start = time.time()
+    latencies = run_sync(timed_ops(ops, concurrency))
+    seconds = time.time() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return summarize(phase, concurrency, latencies, seconds, peak, llm_api.call_stats["calls"] - calls)
+
+def bench_level(agents, library, concurrency, n_items, tag):
+    items = [(f"{tag}-{k}", f"Benchmark Item {tag} {k}") for k in range(n_items)]
+    actions = ["Dislike" if k % 3 == 0 else "Like" for k in range(n_items)]
+    assistant = Assistant(*agents, user_id=f"bench-{tag}", library=library)
+    assistant.set_personality([f"benchmark preference {k}" for k in range(8)], [f"benchmark dispreference {k}" for k in range(4)])
+    results = []
+
+    ops = [lambda item=item: assistant.adescribe_item(*item, log=False) for item in items]
+    results.append(run_phase("describe_item", concurrency, ops))
+
+    ops = [lambda item=item, action=action: assistant.aact(*item, user_action=action, log=False)
+           for item, action in zip(items, actions)]
+    results.append(run_phase("act", concurrency, ops))
+
+    ops = [lambda item=item, action=action: assistant.astep_learn_act_critic(*item, user_action=action, log=False)
+           for item, action in zip(items, actions)]
+    results.append(run_phase("step_learn_act_critic", concurrency, ops))
+
+    # one assistant per reflect, a reflection replaces the assistant's personality
+    reflectors = [Assistant(*agents, user_id=f"bench-{tag}-r{k}", library=library) for k in range(n_items)]
+    for k, reflector in enumerate(reflectors):
+        reflector.set_personality([f"benchmark preference {k} {j}" for j in range(6)], [f"benchmark dispreference {k}"])
+    ops = [lambda reflector=reflector, k=k: reflector.areflect([f"new preference {k}"], [], log=False, dedup=False)
+           for k, reflector in enumerate(reflectors)]
+    results.append(run_phase("reflect", concurrency, ops))
+    return results
+
+def bench_library_load(library_dir, history_dir, **kwargs):
+    tracemalloc.start()
+    start = time.time()
+    library = make_library(library_dir, history_dir, **kwargs)
+    seconds = time.time() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return library, {"phase":"library_load", "concurrency":None, "ops":1, "seconds":seconds,
+                     "ops_per_sec":1 / seconds if seconds > 0 else 0.0, "peak_mb":peak / 2**20}
+
+def run_benchmark(args):
+    server = MockServer(MockConfig(args.latency, args.jitter, args.error_rate, args.rate_limit, args.accuracy, args.seed,
+                                   args.malformed_rate))
+    use_mock_server(server.start())
+    library_dir = args.library_dir or tempfile.mkdtemp(prefix="rah-bench-")
+    agents = get_agents(args.prompt_dir, stream=args.stream, structured=args.structured, tiers=parse_tiers(args.cascade))
+    results = []
+    try:
+        library, load = bench_library_load(library_dir, args.history_dir, backend=args.backend, lazy=args.lazy)
+        results.append(load)
+        for concurrency in args.concurrency:
+            level = bench_level(agents, library, concurrency, args.items, tag=f"c{concurrency}")
+            results.extend(level)
+            for row in level:
+                print(f"{row['phase']:>22} c={concurrency:<3} {row['ops_per_sec']:8.2f} ops/s "
+                      f"p50 {row['p50']:.3f}s p95 {row['p95']:.3f}s peak {row['peak_mb']:.1f} MB", flush=True)
+        library.flush()
+        # reload of the library written above
+        _, reload = bench_library_load(library_dir, args.history_dir, backend=args.backend, lazy=args.lazy)
+        reload["phase"] = "library_reload"
+        results.append(reload)
+    finally:
+        server.stop()
+        if args.library_dir is None:
+            shutil.rmtree(library_dir, ignore_errors=True)
+
+    return {
+        "label":args.label or git_label(), "time":time.time(), "python":platform.python_version(),
+        "config":{key:value for key, value in vars(args).items() if key not in ("output", "compare", "label")},
+        "server":server.stats, "llm":metrics.registry.summary(), "results":results,
+        "max_rss_mb":resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10,     # KiB on linux
+    }
+
+def load_runs(path):
+    if not os.path.exists(path):
+        return []
+    with open(path, "r") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def compare(run, baseline):
+    base = {(row["phase"], row["concurrency"]):row for row in baseline["results"]}
+    print(f"--- {run['label']} vs {baseline['label']} (ops/s ratio, >1 is faster)")
+    for row in run["results"]:
+        old = base.get((row["phase"], row["concurrency"]))
+        if old and old["ops_per_sec"]:
+            print(f"{row['phase']:>22} c={str(row['concurrency']):<4} {row['ops_per_sec'] / old['ops_per_sec']:6.2f}x "
+                  f"peak {row['peak_mb']:.1f} MB (was {old['peak_mb']:.1f})")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark Library, describe_item, act, step_learn_act_critic and reflect on a mock LLM")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--items", type=int, default=32, help="operations per phase and concurrency level")
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--jitter", type=float, default=0.05)
+    parser.add_argument("--error_rate", type=float, default=0.0)
+    parser.add_argument("--rate_limit", type=float, default=None)
+    parser.add_argument("--accuracy", type=float, default=0.7)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--malformed_rate", type=float, default=0.0)
+    parser.add_argument("--stream", action="store_true")
+    parser.add_argument("--structured", action="store_true")
+    parser.add_argument("--cascade", nargs="*", default=None, metavar="AGENT=MODEL,MODEL")
+    parser.add_argument("--prompt_dir", default="./prompt")
+    parser.add_argument("--history_dir", default="./examples")
+    parser.add_argument("--library_dir", default=None, help="defaults to a temporary directory")
+    parser.add_argument("--backend", default="json", choices=["json", "sqlite"])
+    parser.add_argument("--lazy", action="store_true")
+    parser.add_argument("--label", default=None, help="name of this run, defaults to git describe")
+    parser.add_argument("--output", default="./benchmarks/results.jsonl")
+    parser.add_argument("--compare", default=None, help="label of an earlier run in --output, 'last' for the previous one")
+    args = parser.parse_args(argv)
+
+    previous = load_runs(args.output)
+    run = run_benchmark(args)
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "a") as f:
+        f.write(json.dumps(run) + "\n")
+    print(f"saved to {args.output}")
+
+    if args.compare and previous:
+        baseline = previous[-1] if args.compare == "last" else next((r for r in reversed(previous) if r["label"] == args.compare), None)
+        if baseline is None:
+            print(f"no run labelled {args.compare} in {args.output}")
+        else:
+            compare(run, baseline)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+import os
+import sys
+import json
+import sqlite3
+import argparse
+import threading
+import pandas as pd
+from tqdm import tqdm
+from concurrent.futures import ThreadPoolExecutor
+from utils import SCORE_MAP, REVIEW_COLUMNS, META_COLUMNS, make_name
+
+# Streaming builder of the cross1k history layout read by library.read_cross1k_processed:
+#   <output_dir>/<reviewerID>/<learn|proxy|unseen>/<domain>.json
+# Review and meta CSVs are read in chunks into an on-disk SQLite index, so memory stays bounded
+# by the chunk size and by one user's history, whatever the dataset size.
+
+GROUPS = ["learn", "proxy", "unseen"]
+
+def connect(index_path):
+    conn = sqlite3.connect(index_path, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=OFF")
+    return conn
+
+def create_index(conn):
+    conn.execute("CREATE TABLE IF NOT EXISTS meta (domain TEXT, asin TEXT, title TEXT, description TEXT, PRIMARY KEY (domain, asin))")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS reviews (reviewerID TEXT, domain TEXT, reviewerName TEXT, reviewTime INTEGER, "
+        "asin TEXT, overall INTEGER, reviewText TEXT)"
+    )
+
+def to_milliseconds(review_time):
+    # same epoch-millisecond values as pd.to_datetime(...) dumped by DataFrame.to_json
+    timestamps = pd.to_datetime(review_time, errors="coerce")
+    return (timestamps - pd.Timestamp(0)) // pd.Timedelta(milliseconds=1)
+
+def index_domain(conn, data_dir, domain, chunksize=100000):
+    # 1. meta: asin -> title, description
+    meta_path = os.path.join(data_dir, f"meta_{domain}.csv")
+    for chunk in pd.read_csv(meta_path, usecols=META_COLUMNS, chunksize=chunksize, dtype=str):
+        chunk = chunk.dropna(subset=["asin", "title"])
+        conn.executemany(
+            "INSERT OR IGNORE INTO meta VALUES (?, ?, ?, ?)",
+            ((domain, asin, title, description) for asin, title, description in chunk.itertuples(index=False, name=None))
+        )
+        conn.commit()
+
+    # 2. reviews with a score in SCORE_MAP
+    review_path = os.path.join(data_dir, f"{domain}.csv")
+    for chunk in pd.read_csv(review_path, usecols=REVIEW_COLUMNS, chunksize=chunksize, dtype={"reviewerID":str, "asin":str}):
+        chunk = chunk.loc[chunk["overall"].isin(list(SCORE_MAP.keys()))]
+        chunk = chunk.assign(reviewTime=to_milliseconds(chunk["reviewTime"]), overall=chunk["overall"].astype(int))
+        conn.executemany(
+            "INSERT INTO reviews VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                (row.reviewerID, domain, row.reviewerName, None if pd.isna(row.reviewTime) else int(row.reviewTime),
+                 row.asin, row.overall, row.reviewText)
+                for row in chunk.itertuples(index=False)
+            )
+        )
+        conn.commit()
+
+def build_index(data_dir, domains, index_path, chunksize=100000):
+    conn = connect(index_path)
+    create_index(conn)
+    for domain in tqdm(domains, desc="index"):
+        index_domain(conn, data_dir, domain, chunksize)
+    conn.execute("CREATE INDEX IF NOT EXISTS reviews_user ON reviews(reviewerID)")
+    conn.commit()
+    return conn
+
+def select_users(conn, domains, min_reviews=0, max_users=None):
+    # cross-domain users: at least one review in every domain
+    query = ("SELECT reviewerID FROM reviews GROUP BY reviewerID "
+             "HAVING COUNT(DISTINCT domain)=? AND COUNT(*)>=? ORDER BY reviewerID")
+    user_ids = [row[0] for row in conn.execute(query, (len(domains), min_reviews))]
+    return user_ids[:max_users] if max_users else user_ids
+
+def get_user_history(conn, user_id):
+    rows = conn.execute(
+        "SELECT r.reviewerID, r.reviewerName, r.reviewTime, r.asin, m.title, r.overall, r.reviewText, m.description, r.domain "
+        "FROM reviews r JOIN meta m ON r.domain=m.domain AND r.asin=m.asin "
+        "WHERE r.reviewerID=? ORDER BY r.reviewTime, r.rowid", (user_id,)
+    ).fetchall()
+    keys = ["reviewerID", "reviewerName", "reviewTime", "asin", "title", "overall", "reviewText", "description", "domain"]
+
+    history, seen = [], set()
+    for row in rows:
+        record = dict(zip(keys, row))
+        name = make_name(record["title"], record["domain"])     # one item per library item name
+        if name in seen:
+            continue
+        seen.add(name)
+        history.append(record)
+    return history
+
+def split_history(history, ratios=(1/3, 1/3, 1/3)):
+    # chronological split over all domains: oldest reviews are learned, newest are unseen
+    learn_end = round(len(history) * ratios[0])
+    proxy_end = learn_end + round(len(history) * ratios[1])
+    return {"learn":history[:learn_end], "proxy":history[learn_end:proxy_end], "unseen":history[proxy_end:]}
+
+def write_user(output_dir, user_id, splits, domains):
+    for group in GROUPS:
+        group_path = os.path.join(output_dir, user_id, group)
+        os.makedirs(group_path, exist_ok=True)
+        for domain in domains:
+            domain_data = [h for h in splits[group] if h["domain"]==domain]
+            with open(os.path.join(group_path, f"{domain}.json"), "w") as f:
+                json.dump(domain_data, f, indent=4)
+
+def build_cross1k(data_dir, domains, output_dir, index_path=None, min_reviews=0, max_users=None,
+                  ratios=(1/3, 1/3, 1/3), workers=8, chunksize=100000, reuse_index=False):
+    index_path = index_path or os.path.join(output_dir, "build_index.sqlite")
+    os.makedirs(output_dir, exist_ok=True)
+    if reuse_index and os.path.exists(index_path):
+        conn = connect(index_path)
+    else:
+        if os.path.exists(index_path):
+            os.remove(index_path)
+        conn = build_index(data_dir, domains, index_path, chunksize)
+    user_ids = select_users(conn, domains, min_reviews, max_users)
+    conn.close()
+
+    local = threading.local()   # one read connection per writer thread
+    def build_user(user_id):
+        if not hasattr(local, "conn"):
+            local.conn = connect(index_path)
+        splits = split_history(get_user_history(local.conn, user_id), ratios)
+        write_user(output_dir, user_id, splits, domains)
+        return user_id
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for _ in tqdm(executor.map(build_user, user_ids), total=len(user_ids), desc="users"):
+            pass
+    return user_ids
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build <user>/<group>/<domain>.json histories from review and meta CSVs")
+    parser.add_argument("--data_dir", required=True, help="directory with <domain>.csv and meta_<domain>.csv")
+    parser.add_argument("--output_dir", default="./cross1k")
+    parser.add_argument("--domains", nargs="+", default=["Movies_and_TV", "Books", "Video_Games"])
+    parser.add_argument("--index_path", default=None)
+    parser.add_argument("--reuse_index", action="store_true")
+    parser.add_argument("--min_reviews", type=int, default=0)
+    parser.add_argument("--max_users", type=int, default=None)
+    parser.add_argument("--ratios", type=float, nargs=3, default=[1/3, 1/3, 1/3], help="learn proxy unseen")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--chunksize", type=int, default=100000)
+    args = parser.parse_args(argv)
+
+    user_ids = build_cross1k(args.data_dir, args.domains, args.output_dir, args.index_path, args.min_reviews,
+                             args.max_users, args.ratios, args.workers, args.chunksize, args.reuse_index)
+    print(f"{len(user_ids)} users written to {args.output_dir}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+
+def hash_text(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def make_cache_key(model_name, temperature, system_prompt, user_prompt):
+    # content-addressed: identical prompts to the same model/temperature share one entry
+    key = f"{model_name}|{temperature}|{hash_text(system_prompt)}|{hash_text(user_prompt)}"
+    return hash_text(key)
+
+
+class ResponseCache:
+    """On-disk cache of chat completions, evicted by age and least-recent use."""
+
+    def __init__(self, cache_path, max_entries=100000, max_bytes=1 << 30, max_age=None, fresh_sampling=False):
+        # max_age: seconds an entry stays valid, None keeps entries until evicted by size
+        # fresh_sampling: bypass the cache for temperature>0 calls that must stay fresh. Off by default, so
+        # sampled calls (the agents' default temperature is 0.7) are replayed too: a rerun gets the same answers
+        self.cache_path = cache_path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.fresh_sampling = fresh_sampling
+        self.enabled = True
+        self.stats = {"hits":0, "misses":0, "bypass":0, "evictions":0}
+
+        cache_dir = os.path.dirname(cache_path)
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(cache_path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, model TEXT, temperature REAL, response TEXT, "
+            "size INTEGER, created REAL, accessed REAL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses(accessed)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS responses_created ON responses(created)")
+        # running totals checked by evict, counted once here and kept by put/delete
+        # (entries another process adds to the same file are only counted on the next open)
+        self.count, self.total = self.conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+
+    def should_bypass(self, temperature):
+        return (not self.enabled) or (self.fresh_sampling and temperature is not None and temperature > 0)
+
+    def get(self, model_name, temperature, system_prompt, user_prompt):
+        if self.should_bypass(temperature):
+            self.stats["bypass"] += 1
+            return None
+        key = make_cache_key(model_name, temperature, system_prompt, user_prompt)
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute("SELECT response, created, size FROM responses WHERE key=?", (key,)).fetchone()
+            if row is not None and self.max_age is not None and now - row[1] > self.max_age:
+                self.conn.execute("DELETE FROM responses WHERE key=?", (key,))
+                self.count -= 1
+                self.total -= row[2]
+                self.stats["evictions"] += 1
+                row = None
+            if row is None:
+                self.stats["misses"] += 1
+                return None
+            self.conn.execute("UPDATE responses SET accessed=? WHERE key=?", (now, key))
+            self.stats["hits"] += 1
+        return row[0]
+
+    def put(self, model_name, temperature, system_prompt, user_prompt, response):
+        if self.should_bypass(temperature):
+            return
+        key = make_cache_key(model_name, temperature, system_prompt, user_prompt)
+        now = time.time()
+        size = len(response.encode("utf-8"))
+        with self.lock:
+            replaced = self.conn.execute("SELECT size FROM responses WHERE key=?", (key,)).fetchone()
+            self.conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, model_name, temperature, response, size, now, now)
+            )
+            if replaced is not None:
+                self.count -= 1
+                self.total -= replaced[0]
+            self.count += 1
+            self.total += size
+            self.evict()
+
+    def evict(self):
+        # caller holds self.lock
+        evicted = 0
+        if self.max_age is not None:
+            # index range over the expired entries only
+            expired = time.time() - self.max_age
+            n, size = self.conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses WHERE created<?", (expired,)).fetchone()
+            if n:
+                self.conn.execute("DELETE FROM responses WHERE created<?", (expired,))
+                self.count -= n
+                self.total -= size
+                evicted += n
+
+        while self.count > self.max_entries or self.total > self.max_bytes:
+            # drop least recently used entries in small batches
+            n = self.count - self.max_entries if self.count > self.max_entries else 16
+            rows = self.conn.execute("SELECT key, size FROM responses ORDER BY accessed LIMIT ?", (n,)).fetchall()
+            if not rows:
+                self.count, self.total = 0, 0
+                break
+            self.conn.executemany("DELETE FROM responses WHERE key=?", [(r[0],) for r in rows])
+            self.count -= len(rows)
+            self.total -= sum(r[1] for r in rows)
+            evicted += len(rows)
+        self.stats["evictions"] += evicted
+        return evicted
+
+    def hit_rate(self):
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return self.stats["hits"] / lookups if lookups else 0.0
+
+    def clear(self):
+        with self.lock:
+            self.conn.execute("DELETE FROM responses")
+            self.count, self.total = 0, 0
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,307 @@
+import os
+import json
+import time
+import atexit
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl        # POSIX advisory locks, serialize writers of different processes
+except ImportError:
+    fcntl = None
+
+# Helpers for Library's append-only JSON-lines logs:
+# an offset index (key -> byte offset of the live line) kept in a "<log>.idx" sidecar, compaction,
+# and a writer that group-commits appends under an exclusive file lock.
+
+def index_path_of(file_path):
+    return file_path + ".idx"
+
+def iter_lines(file_path, start=0, end=None):
+    # yields (offset, line bytes) of every complete line in [start, end)
+    with open(file_path, "rb") as f:
+        f.seek(start)
+        offset = start
+        for line in f:
+            if end is not None and offset >= end:
+                break
+            if not line.endswith(b"\n"):
+                break       # a writer is still appending this line
+            yield offset, line
+            offset += len(line)
+
+@contextmanager
+def locked_append(file_path):
+    # "ab" handle positioned at the end, exclusively locked; reopened if compaction swapped the file meanwhile
+    while True:
+        f = open(file_path, "ab")
+        if fcntl is None:
+            break
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            if os.fstat(f.fileno()).st_ino == os.stat(file_path).st_ino:
+                break
+        except FileNotFoundError:
+            pass
+        f.close()
+    try:
+        f.seek(0, os.SEEK_END)
+        yield f
+    finally:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+        f.close()
+
+def append_line(file_path, data):
+    # returns the byte range the line was written at
+    line = (json.dumps(data) + "\n").encode("utf-8")
+    with locked_append(file_path) as f:
+        offset = f.tell()
+        f.write(line)
+    return offset, offset + len(line)
+
+
+class OffsetIndex:
+    """key -> byte offset of the last line written for key in one JSON-lines log"""
+
+    def __init__(self, file_path, key_fn):
+        self.file_path = file_path
+        self.index_path = index_path_of(file_path)
+        self.key_fn = key_fn            # parsed line -> str key
+        self.offsets = {}
+        self.covered = 0                # log bytes already indexed
+        self.lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        self.offsets, self.covered = {}, 0
+        if os.path.exists(self.index_path):
+            with open(self.index_path, "r") as f:
+                for line in f:
+                    try:
+                        key, offset, end = json.loads(line)
+                    except ValueError:
+                        break       # torn sidecar line, the tail scan below re-indexes it
+                    self.offsets[key] = offset
+                    self.covered = max(self.covered, end)
+        self.catch_up()
+
+    def catch_up(self):
+        # index lines appended without going through add(), e.g. by another process
+        if not os.path.exists(self.file_path):
+            return
+        size = os.path.getsize(self.file_path)
+        if self.covered > size:         # log was replaced under us
+            self.rebuild()
+            return
+        new_entries = []
+        try:
+            for offset, line in iter_lines(self.file_path, self.covered):
+                new_entries.append((self.key_fn(json.loads(line)), offset, offset + len(line)))
+        except ValueError:
+            self.rebuild()              # covered does not point at a line start any more (compacted)
+            return
+        for key, offset, end in new_entries:
+            self.offsets[key] = offset
+            self.covered = end
+        if new_entries:
+            self.write_entries(new_entries, mode="a")
+
+    def rebuild(self):
+        entries = []
+        for offset, line in iter_lines(self.file_path):
+            entries.append((self.key_fn(json.loads(line)), offset, offset + len(line)))
+        self.offsets = {key: offset for key, offset, _ in entries}
+        self.covered = entries[-1][2] if entries else 0
+        self.write_entries([(key, offset, self.covered) for key, offset in self.offsets.items()], mode="w")
+
+    def write_entries(self, entries, mode="a"):
+        with open(self.index_path, mode) as f:
+            for entry in entries:
+                f.write(json.dumps(list(entry)) + "\n")
+
+    def add(self, key, offset, end):
+        with self.lock:
+            if offset != self.covered:
+                self.catch_up()
+            self.offsets[key] = offset
+            self.covered = max(self.covered, end)
+            self.write_entries([(key, offset, end)])
+
+    def read(self, key):
+        if key not in self.offsets:
+            return None
+        for _ in range(2):
+            with open(self.file_path, "rb") as f:
+                f.seek(self.offsets[key])
+                line = f.readline()
+            try:
+                data = json.loads(line)
+                if self.key_fn(data) == key:
+                    return data
+            except ValueError:
+                pass
+            self.rebuild()          # stale sidecar, re-scan once
+            if key not in self.offsets:
+                return None
+        return None
+
+    def __contains__(self, key):
+        return key in self.offsets
+
+    def keys(self):
+        return self.offsets.keys()
+
+
+def compact_log(file_path, key_fn, lock=None):
+    """Rewrite a JSON-lines log with only the last line of every key and a fresh offset index.
+
+    The bulk of the log is read without holding `lock`; the writers' lock is only taken to copy
+    the lines appended meanwhile and to swap the files atomically.
+    """
+    if not os.path.exists(file_path):
+        return 0, 0
+    lock = lock or threading.Lock()
+    snapshot = os.path.getsize(file_path)
+
+    live = {}
+    total, consumed = 0, 0
+    for offset, line in iter_lines(file_path, 0, snapshot):
+        key = key_fn(json.loads(line))
+        live.pop(key, None)
+        live[key] = line        # re-insert so the order follows the last write
+        total, consumed = total + 1, offset + len(line)
+
+    tmp_path = file_path + ".compact"
+    with lock, locked_append(file_path):     # also holds off writers of other processes until the swap
+        for offset, line in iter_lines(file_path, consumed):
+            key = key_fn(json.loads(line))
+            live.pop(key, None)
+            live[key] = line
+            total += 1
+
+        offsets = {}
+        with open(tmp_path, "wb") as f:
+            for key, line in live.items():
+                offsets[key] = f.tell()
+                f.write(line)
+            end = f.tell()
+            f.flush()
+            os.fsync(f.fileno())
+        with open(tmp_path + ".idx", "w") as f:
+            for key, offset in offsets.items():
+                f.write(json.dumps([key, offset, end]) + "\n")
+        os.replace(tmp_path + ".idx", index_path_of(file_path))
+        os.replace(tmp_path, file_path)
+
+    return total, len(live)
+
+
+class LogWriter:
+    """Serialized, group-committed appends to JSON-lines logs.
+
+    flush_interval=None writes every line in the caller's thread. Otherwise lines are queued per file
+    and a background thread commits each file's queue as one write every flush_interval seconds
+    (sooner once max_pending lines wait). fsync: "never" leaves durability to the OS, "commit" fsyncs
+    every commit. Each commit holds an exclusive lock on the file, so processes sharing a log never
+    interleave lines, and on_commit(offset, end) runs under that lock (e.g. OffsetIndex.add).
+    """
+
+    def __init__(self, flush_interval=None, fsync="never", max_pending=1024):
+        if fsync not in ("never", "commit"):
+            raise ValueError(f"Unknown fsync policy: {fsync}")
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.max_pending = max_pending
+        self.pending = {}               # file path -> [(line bytes, on_commit)]
+        self.pending_count = 0
+        self.lock = threading.Lock()
+        self.wakeup = threading.Condition(self.lock)
+        self.file_locks = {}            # file path -> threading.Lock, one commit per file at a time
+        self.thread = None
+        self.closed = False
+        self.stats = {"records":0, "commits":0, "bytes":0, "commit_seconds":0.0, "start":None}
+
+    def append(self, file_path, data, on_commit=None):
+        line = (json.dumps(data) + "\n").encode("utf-8")
+        if self.stats["start"] is None:
+            self.stats["start"] = time.time()
+        if self.flush_interval is None:
+            with self.file_lock(file_path):
+                self.commit(file_path, [(line, on_commit)])
+            return
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name="library-writer", daemon=True)
+                self.thread.start()
+                atexit.register(self.close)
+            self.pending.setdefault(file_path, []).append((line, on_commit))
+            self.pending_count += 1
+            if self.pending_count >= self.max_pending:
+                self.wakeup.notify()
+
+    def file_lock(self, file_path):
+        with self.lock:
+            return self.file_locks.setdefault(file_path, threading.Lock())
+
+    def commit(self, file_path, entries):
+        # caller holds file_lock(file_path)
+        start = time.time()
+        lines = b"".join(line for line, _ in entries)
+        with locked_append(file_path) as f:
+            offset = f.tell()
+            f.write(lines)
+            f.flush()
+            if self.fsync == "commit":
+                os.fsync(f.fileno())
+            for line, on_commit in entries:
+                if on_commit is not None:
+                    on_commit(offset, offset + len(line))
+                offset += len(line)
+        with self.lock:
+            self.stats["records"] += len(entries)
+            self.stats["commits"] += 1
+            self.stats["bytes"] += len(lines)
+            self.stats["commit_seconds"] += time.time() - start
+
+    def has_pending(self, file_path):
+        with self.lock:
+            return bool(self.pending.get(file_path))
+
+    def flush(self, file_path=None):
+        # commit queued lines now, of one file or of all files
+        with self.lock:
+            file_paths = [file_path] if file_path is not None else list(self.pending)
+        for path in file_paths:
+            with self.file_lock(path):
+                with self.lock:
+                    entries = self.pending.pop(path, [])
+                    self.pending_count -= len(entries)
+                if entries:
+                    self.commit(path, entries)
+
+    def run(self):
+        while True:
+            with self.lock:
+                if not self.closed:
+                    self.wakeup.wait(self.flush_interval)
+                closed = self.closed
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"library-writer commit failed: {e!r}")
+            if closed:
+                return
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            self.wakeup.notify()
+        self.flush()
+
+    def throughput(self):
+        # committed records per second since the first append
+        with self.lock:
+            if self.stats["start"] is None:
+                return 0.0
+            return self.stats["records"] / max(time.time() - self.stats["start"], 1e-6)
@@ -1,33 +1,102 @@
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 import os
 import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, Future
+from storage import SqliteStorage
+from jsonlog import OffsetIndex, LogWriter, compact_log
+
+try:
+    from orjson import loads as json_loads     # optional, faster parser
+except ImportError:
+    json_loads = json.loads
 
 def deep_defaultdict():
     return defaultdict(deep_defaultdict)
 
-def read_jsons_from_dir(directory, filename_to_feature=None):
-    json_files = [ pos_json for pos_json in os.listdir(directory) if pos_json.endswith('.json') ]
-    data = []
+def detect_json_lines(raw):
+    # JSON-lines when the first line is already a complete JSON value, a pretty-printed document is not
+    first_line = raw.lstrip().split(b"\n", 1)[0]
+    if not first_line.strip():
+        return False, None
+    try:
+        return True, json_loads(first_line)
+    except ValueError:
+        return False, None
 
-    for index, js in enumerate(json_files):
+def parse_json_lines(lines, js, feature, filename_to_feature=None, first=None):
+    # one value per line, a bad line costs only itself
+    d, errors = [], []
+    for line_no, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
         try:
-            with open(os.path.join(directory, js)) as json_file:
-                d = json.load(json_file)
-                if filename_to_feature is not None:
-                    d[filename_to_feature] = js.split(".")[0]
-        except:
-            with open(os.path.join(directory, js)) as json_file:
-                d = []
-                for line in json_file:
-                    try:
-                        d.append(json.loads(line))
-                    except:
-                        print(js.split(".")[0])
-                    if filename_to_feature is not None:
-                        d[-1][filename_to_feature] = js.split(".")[0]
-                
+            value = first if line_no==1 and first is not None else json_loads(line)
+        except ValueError as e:
+            errors.append((js, line_no, str(e)))
+            continue
+        if filename_to_feature is not None and type(value)==dict:
+            value[filename_to_feature] = feature
+        d.append(value)
+    return d, errors
+
+def parse_json_file(file_path, filename_to_feature=None):
+    """Parse one JSON or JSON-lines file in a single pass, returns (data, errors)"""
+    js = os.path.basename(file_path)
+    feature = js.split(".")[0]
+    errors = []
+    with open(file_path, "rb") as json_file:
+        raw = json_file.read()
+
+    is_lines, first = detect_json_lines(raw)
+    lines = raw.lstrip().split(b"\n")
+    if not is_lines:
+        if not raw.strip():
+            return [], errors
+        try:
+            d = json_loads(raw)
+        except ValueError as e:
+            if sum(1 for line in lines if line.strip()) > 1:
+                # e.g. a JSON-lines log whose first line was torn by a crash, keep the lines that parse
+                return parse_json_lines(lines, js, feature, filename_to_feature)
+            return [], [(js, None, str(e))]
+        if filename_to_feature is not None and type(d)==dict:
+            d[filename_to_feature] = feature
+        return d, errors
+
+    return parse_json_lines(lines, js, feature, filename_to_feature, first)
+
+def report_errors(errors):
+    for js, line_no, message in errors:
+        where = js if line_no is None else f"{js}:{line_no}"
+        print(f"Failed to parse {where}: {message}")
 
+def read_json_file(file_path, filename_to_feature=None):
+    d, errors = parse_json_file(file_path, filename_to_feature)
+    report_errors(errors)
+    return d
+
+def read_jsons_from_dir(directory, filename_to_feature=None, workers=None, use_processes=False, errors=None):
+    # workers: parse files in a thread pool (or a process pool with use_processes), None picks by cpu count
+    # errors: optional list collecting (file, line, message) of every entry that failed to parse
+    json_files = [ os.path.join(directory, pos_json) for pos_json in os.listdir(directory) if pos_json.endswith('.json') ]
+    workers = workers or min(32, (os.cpu_count() or 1) + 4)
+
+    if len(json_files) <= 1 or workers <= 1:
+        results = [parse_json_file(path, filename_to_feature) for path in json_files]
+    else:
+        pool = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+        chunksize = max(1, len(json_files) // (workers * 4))
+        with pool(max_workers=workers) as executor:
+            results = list(executor.map(parse_json_file, json_files, [filename_to_feature] * len(json_files), chunksize=chunksize))
+
+    data = []
+    for d, file_errors in results:
         data.append(d)
+        report_errors(file_errors)
+        if errors is not None:
+            errors.extend(file_errors)
     
     return data
 
@@ -72,98 +141,533 @@ def load_personality_library(personality_library_path):
 
     return personality_library
 
+def add_records(record_library, data, on_types=["learn-act-critic"]):
+    data=[data] if type(data)!=list else data   # a single-line file parses as one record
+    for d in data:
+        if d["type"] not in on_types:
+            continue
+        # KEY: type/user_id/item_id/action/
+        record_library[d["type"]][d["user_id"]][d["item_id"]][d["user_action"]] = d  # indicate domain
+    return record_library
+
 def load_record_library(record_library_path, on_types=["learn-act-critic"]):
     record_library = deep_defaultdict()
     data_list = read_jsons_from_dir(record_library_path, filename_to_feature = "user_id")
     for data in data_list:
-        for d in data:
-            if d["type"] not in on_types:
-                continue
-            # KEY: type/user_id/item_id/action/
-            record_library[d["type"]][d["user_id"]][d["item_id"]][d["user_action"]] = d  # indicate domain
+        add_records(record_library, data, on_types)
 
     return record_library
 
+def read_cross1k_user(dataset_dir, user_id):
+    user_map = {}
+    user_path = os.path.join(dataset_dir, user_id)
+    group_list = os.listdir(user_path)
+
+    for group in group_list:
+        user_map[group] = {}
+        group_path = os.path.join(user_path, group)
+        domain_filename_list = os.listdir(group_path)
+
+        for domain_filename in domain_filename_list:
+            domain_file_path = os.path.join(group_path, domain_filename)
+            with open(domain_file_path, "r") as f:
+                domain_data = json.load(f)
+            domain = domain_filename.split(".")[0]
+            user_map[group][domain] = domain_data
+
+    return user_map
+
+def list_cross1k_users(dataset_dir):
+    return list(filter(lambda x: x[0]=="A", os.listdir(dataset_dir)))
+
 def read_cross1k_processed(dataset_dir):
     data_map = {}
-    user_id_list = list(filter(lambda x: x[0]=="A", os.listdir(dataset_dir)))
+    user_id_list = list_cross1k_users(dataset_dir)
 
     for user_id in user_id_list:
-        data_map[user_id] = {}
-        user_path = os.path.join(dataset_dir, user_id)
-        group_list = os.listdir(user_path)
+        data_map[user_id] = read_cross1k_user(dataset_dir, user_id)
+
+    return data_map
 
-        for group in group_list:
-            data_map[user_id][group] = {}
-            group_path = os.path.join(user_path, group)
-            domain_filename_list = os.listdir(group_path)
 
-            for domain_filename in domain_filename_list:
-                domain_file_path = os.path.join(group_path, domain_filename)
-                with open(domain_file_path, "r") as f:
-                    domain_data = json.load(f)
-                domain = domain_filename.split(".")[0]
-                data_map[user_id][group][domain] = domain_data
+# lazy mode: views that read one user's / item's files on first access
 
+class LRUCache:
+    """Bounded map of loaded entries, counts loads, hits, evictions and load time"""
 
-    return data_map
+    def __init__(self, loader, maxsize=1024):
+        self.loader = loader
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.lock = threading.RLock()
+        self.stats = {"loads":0, "hits":0, "evictions":0, "load_seconds":0.0}
 
+    def get(self, key):
+        with self.lock:
+            if key in self.data:
+                self.data.move_to_end(key)
+                self.stats["hits"] += 1
+                return self.data[key]
+        start = time.perf_counter()
+        value = self.loader(key)
+        with self.lock:
+            self.stats["loads"] += 1
+            self.stats["load_seconds"] += time.perf_counter() - start
+            if key in self.data:            # loaded concurrently, keep the first copy
+                return self.data[key]
+            self.put(key, value)
+        return value
 
-class Library:
-    def __init__(self, item_path, record_path, personality_path, history_path):
+    def put(self, key, value):
+        with self.lock:
+            self.data[key] = value
+            self.data.move_to_end(key)
+            while self.maxsize is not None and len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    def invalidate(self, key):
+        with self.lock:
+            self.data.pop(key, None)
+
+    def summary(self):
+        stats = dict(self.stats)
+        stats["cached"] = len(self.data)
+        stats["avg_load_ms"] = 1000 * stats["load_seconds"] / stats["loads"] if stats["loads"] else 0.0
+        return stats
+
+
+def list_json_names(directory):
+    if not os.path.isdir(directory):
+        return []
+    return [name[:-len(".json")] for name in os.listdir(directory) if name.endswith(".json")]
+
+class LazyNestedView:
+    """Nested mapping whose depth-th key loads one entry through an LRUCache keyed on the key path"""
+
+    def __init__(self, cache, depth, list_keys, prefix=()):
+        self.cache = cache
+        self.depth = depth
+        self.list_keys = list_keys      # prefix -> keys available on disk
+        self.prefix = prefix
+
+    def __getitem__(self, key):
+        prefix = self.prefix + (key,)
+        if len(prefix) < self.depth:
+            return LazyNestedView(self.cache, self.depth, self.list_keys, prefix)
+        return self.cache.get(prefix)
+
+    def __setitem__(self, key, value):
+        prefix = self.prefix + (key,)
+        if len(prefix) < self.depth:
+            raise TypeError("only leaf entries can be assigned")
+        self.cache.put(prefix, value)
+
+    def __contains__(self, key):
+        return key in self.keys()
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def keys(self):
+        return self.list_keys(self.prefix)
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+    def values(self):
+        return [self[key] for key in self.keys()]
+
+class LazyRecordView:
+    """type/user_id/item_id/action/, the first access to a user reads that user's record file"""
+
+    def __init__(self, users, record_types, record_path):
+        self.users = users              # LRUCache: user_id -> deep_defaultdict type/item_id/action/
+        self.record_types = record_types
+        self.record_path = record_path
+
+    def __getitem__(self, r_type):
+        return LazyRecordTypeView(self, r_type)
+
+    def __iter__(self):
+        return iter(self.record_types)
+
+    def keys(self):
+        return list(self.record_types)
+
+class LazyRecordTypeView:
+    def __init__(self, records, r_type):
+        self.records = records
+        self.r_type = r_type
+
+    def __getitem__(self, user_id):
+        return self.records.users.get(user_id)[self.r_type]
+
+    def __contains__(self, user_id):
+        return bool(self[user_id])
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def keys(self):
+        return list_json_names(self.records.record_path)
+
+class LazyItemView:
+    """item_name -> item, each item is read with one seek through the item logs' offset indexes"""
+
+    def __init__(self, storage, cache_size=1024):
+        self.storage = storage
+        self.cache = LRUCache(storage.read_item, cache_size)
+
+    def __getitem__(self, item_name):
+        item = self.cache.get(item_name)
+        if item is None:
+            self.cache.invalidate(item_name)
+            raise KeyError(item_name)
+        return item
+
+    def __setitem__(self, item_name, item):
+        self.cache.put(item_name, item)
+
+    def __contains__(self, item_name):
+        return item_name in self.cache.data or self.storage.has_item(item_name)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def get(self, item_name, default=None):
+        return self[item_name] if item_name in self else default
+
+    def keys(self):
+        return self.storage.item_names()
+
+    def items(self):
+        return [(item_name, self[item_name]) for item_name in self.keys()]
+
+    def values(self):
+        return [self[item_name] for item_name in self.keys()]
+
+def load_user_records(record_path, user_id, on_types=["learn-act-critic"]):
+    user_records = deep_defaultdict()
+    file_path = os.path.join(record_path, f"{user_id}.json")
+    if os.path.exists(file_path):
+        add_records(user_records, read_json_file(file_path, filename_to_feature = "user_id"), on_types)
+    # type/user_id/... -> type/...
+    by_type = deep_defaultdict()
+    for r_type, users in user_records.items():
+        by_type[r_type] = users[user_id]
+    return by_type
+
+def load_user_personality(personality_path, mode, domain, user_id):
+    file_path = os.path.join(personality_path, mode, domain, f"{user_id}.json")
+    if not os.path.exists(file_path):
+        return {}
+    data = read_json_file(file_path, filename_to_feature = "user_id")
+    data = [data] if type(data)!=list else data
+    return data[-1] if data else {}
+
+def list_personality_keys(personality_path, prefix):
+    directory = os.path.join(personality_path, *prefix)
+    if len(prefix) < 2:
+        return os.listdir(directory) if os.path.isdir(directory) else []
+    return list_json_names(directory)
 
+
+# keys of the live line in each append log, later lines of the same key supersede earlier ones
+def item_key(d):
+    return d[0] if type(d)==list else d.get("item")
+
+def record_key(d):
+    return json.dumps([d["type"], d["item_id"], d["user_action"]])
+
+def personality_key(d):
+    return ""       # one user per file, the last line wins
+
+def parse_item(d):
+    if d is None:
+        return None
+    if type(d[1])==str:
+        return {"item":d[0], "item_information":d[1]}
+    return d[1]
+
+
+class JsonStorage:
+    """Append-only JSON-lines files, every file is parsed into memory on start"""
+
+    def __init__(self, item_path, record_path, personality_path, record_types=["learn-act-critic"], item_file="items.json",
+                 flush_interval=None, fsync="never"):
         self.item_path = item_path
         self.record_path = record_path
         self.personality_path = personality_path
-        self.history_path = history_path
+        self.item_file = item_file          # one file per writer process, every *.json in item_path is loaded
+        self.indexes = {}                   # file path -> OffsetIndex, opened on the first point read
+        self.writer = LogWriter(flush_interval, fsync)
 
         self.item_dict = load_item_library(item_path)                        # item_name
-        self.record_dict = load_record_library(record_path)                  # type/user_id/item_id/action/
+        self.record_dict = load_record_library(record_path, record_types)    # type/user_id/item_id/action/
         self.personality_dict = load_personality_library(personality_path)   # mode/domain/user_id
-        self.history_dict = read_cross1k_processed(history_path)             # user_id/group/domain
+
+    def append(self, save_dir_path, filename, data, key_fn):
+        save_file_path = os.path.join(save_dir_path, filename)
+        os.makedirs(save_dir_path, exist_ok=True)
+        key = key_fn(data)
+
+        def index_line(offset, end):
+            if save_file_path in self.indexes:
+                self.indexes[save_file_path].add(key, offset, end)
+
+        self.writer.append(save_file_path, data, index_line)
+
+    def save_item(self, item_name, item):
+        # state
+        self.item_dict[item_name] = item
+        # file
+        self.append(self.item_path, self.item_file, [item_name, item], item_key)
+
+    def save_personality(self, mode, domain, user_id, personality):
+        self.personality_dict[mode][domain][user_id] = personality
+        self.append(os.path.join(self.personality_path, mode, domain), f"{user_id}.json", personality, personality_key)
+
+    def save_record(self, r_type, user_id, item_id, action, record):
+        self.record_dict[r_type][user_id][item_id][action] = record
+        self.append(self.record_path, f"{user_id}.json", record, record_key)
+
+    # point reads through the offset index
+    def get_index(self, file_path, key_fn):
+        self.writer.flush(file_path)        # reads see every saved line
+        if file_path not in self.indexes:
+            self.indexes[file_path] = OffsetIndex(file_path, key_fn)
+        return self.indexes[file_path]
+
+    def item_files(self):
+        # no flush here: get_index commits only the file it reads, other queued logs keep waiting for their group commit
+        files = []
+        if os.path.isdir(self.item_path):
+            files = [os.path.join(self.item_path, name) for name in sorted(os.listdir(self.item_path)) if name.endswith(".json")]
+        own_file = os.path.join(self.item_path, self.item_file)
+        if own_file not in files and self.writer.has_pending(own_file):
+            files.append(own_file)      # first items of this process are still queued
+        return files
+
+    def has_item(self, item_name):
+        return any(item_name in self.get_index(path, item_key) for path in self.item_files())
+
+    def item_names(self):
+        names = set()
+        for path in self.item_files():
+            names.update(self.get_index(path, item_key).keys())
+        return list(names)
+
+    def read_item(self, item_name):
+        for path in self.item_files():
+            index = self.get_index(path, item_key)
+            if item_name in index:
+                return parse_item(index.read(item_name))
+        return None
+
+    def read_record(self, r_type, user_id, item_id, action):
+        file_path = os.path.join(self.record_path, f"{user_id}.json")
+        self.writer.flush(file_path)        # only this user's log, before the existence check
+        if not os.path.exists(file_path):
+            return None
+        record = self.get_index(file_path, record_key).read(record_key({"type":r_type, "item_id":item_id, "user_action":action}))
+        if record is not None:
+            record["user_id"] = user_id
+        return record
+
+    # compaction
+    def log_files(self):
+        logs = [(path, item_key) for path in self.item_files()]
+        if os.path.isdir(self.record_path):
+            logs += [(os.path.join(self.record_path, name), record_key) for name in os.listdir(self.record_path) if name.endswith(".json")]
+        for root, _, files in os.walk(self.personality_path):
+            logs += [(os.path.join(root, name), personality_key) for name in files if name.endswith(".json")]
+        return logs
+
+    def compact(self, lock=None):
+        self.writer.flush()
+        stats = {"files":0, "lines_before":0, "lines_after":0}
+        for file_path, key_fn in self.log_files():
+            before, after = compact_log(file_path, key_fn, lock)
+            self.indexes.pop(file_path, None)
+            stats["files"] += 1
+            stats["lines_before"] += before
+            stats["lines_after"] += after
+        return stats
+
+
+class LazyJsonStorage(JsonStorage):
+    """Same files as JsonStorage, loaded per user / per item on first access into bounded LRUs"""
+
+    def __init__(self, item_path, record_path, personality_path, record_types=["learn-act-critic"], item_file="items.json", cache_size=1024,
+                 flush_interval=None, fsync="never"):
+        self.item_path = item_path
+        self.record_path = record_path
+        self.personality_path = personality_path
+        self.item_file = item_file
+        self.writer = LogWriter(flush_interval, fsync)
+
+        # an evicted entry is re-read from its file, so that file's queued lines are committed first
+        def load_records(user_id):
+            self.writer.flush(os.path.join(record_path, f"{user_id}.json"))
+            return load_user_records(record_path, user_id, record_types)
+
+        def load_personality(key):
+            mode, domain, user_id = key
+            self.writer.flush(os.path.join(personality_path, mode, domain, f"{user_id}.json"))
+            return load_user_personality(personality_path, *key)
+
+        self.record_users = LRUCache(load_records, cache_size)
+        self.personalities = LRUCache(load_personality, cache_size)
+
+        self.indexes = {}
+
+        self.item_dict = LazyItemView(self, cache_size)                                                   # item_name
+        self.record_dict = LazyRecordView(self.record_users, record_types, record_path)                   # type/user_id/item_id/action/
+        self.personality_dict = LazyNestedView(self.personalities, 3,
+                                               lambda prefix: list_personality_keys(personality_path, prefix))  # mode/domain/user_id
+
+    def load_stats(self):
+        return {
+            "item":self.item_dict.cache.summary(),
+            "record":self.record_users.summary(),
+            "personality":self.personalities.summary()
+        }
+
+
+class Library:
+    def __init__(self, item_path, record_path, personality_path, history_path,
+                 record_types=["learn-act-critic"], item_file="items.json", backend="json", db_path=None,
+                 lazy=False, cache_size=1024, flush_interval=None, fsync="never"):
+
+        self.item_path = item_path
+        self.record_path = record_path
+        self.personality_path = personality_path
+        self.history_path = history_path
+
+        # backend: "json" keeps the append-only files, "sqlite" keeps items/records/personalities in one indexed file
+        # lazy: read each user's / item's data on first access and keep at most cache_size entries per dict
+        # flush_interval/fsync: group commit of the json logs, see jsonlog.LogWriter (None writes every save at once)
+        if backend == "sqlite":
+            db_path = db_path or os.path.join(os.path.dirname(os.path.normpath(item_path)), "library.sqlite")
+            self.storage = SqliteStorage(db_path)
+        elif backend == "json" and lazy:
+            self.storage = LazyJsonStorage(item_path, record_path, personality_path, record_types, item_file, cache_size,
+                                           flush_interval, fsync)
+        elif backend == "json":
+            self.storage = JsonStorage(item_path, record_path, personality_path, record_types, item_file, flush_interval, fsync)
+        else:
+            raise ValueError(f"Unknown library backend: {backend}")
+
+        self.item_dict = self.storage.item_dict                              # item_name
+        self.record_dict = self.storage.record_dict                          # type/user_id/item_id/action/
+        self.personality_dict = self.storage.personality_dict                # mode/domain/user_id
+        if lazy:
+            self.history_users = LRUCache(lambda key: read_cross1k_user(history_path, key[0]), cache_size)
+            self.history_dict = LazyNestedView(self.history_users, 1, lambda prefix: list_cross1k_users(history_path))
+        else:
+            self.history_dict = read_cross1k_processed(history_path)         # user_id/group/domain
+
+        self.lock = threading.RLock()     # serialize state and file updates of concurrent writers
+        self.inflight_items = {}          # item_name -> Future of the one describe call in progress
         
+    def compact(self, background=False):
+        # rewrite the append logs with only their live entries; writers are only blocked for the final swap
+        if background:
+            thread = threading.Thread(target=self.storage.compact, args=(self.lock,), name="library-compact", daemon=True)
+            thread.start()
+            return thread
+        return self.storage.compact(self.lock)
+
+    def claim_item(self, item_name):
+        """Single flight for item descriptions: returns (future, owner).
+
+        The owner describes the item, saves it, resolves the future and calls release_item;
+        every other caller waits on the same future instead of making its own call.
+        """
+        with self.lock:
+            if item_name in self.item_dict:         # saved since the caller looked
+                future = Future()
+                future.set_result(self.item_dict[item_name])
+                return future, False
+            future = self.inflight_items.get(item_name)
+            if future is not None:
+                return future, False
+            future = Future()
+            self.inflight_items[item_name] = future
+            return future, True
+
+    def release_item(self, item_name):
+        with self.lock:
+            self.inflight_items.pop(item_name, None)
+
+    def read_item(self, item_name):
+        return self.storage.read_item(item_name)
+
+    def read_record(self, r_type, user_id, item_id, action):
+        return self.storage.read_record(r_type, user_id, item_id, action)
+
+    def load_stats(self):
+        stats = self.storage.load_stats() if hasattr(self.storage, "load_stats") else {}
+        if hasattr(self, "history_users"):
+            stats["history"] = self.history_users.summary()
+        return stats
+
+    def flush(self):
+        # commit every queued save of the group-commit writer
+        if hasattr(self.storage, "writer"):
+            self.storage.writer.flush()
+
+    def write_stats(self):
+        if not hasattr(self.storage, "writer"):
+            return {}
+        return {**self.storage.writer.stats, "records_per_sec":self.storage.writer.throughput()}
+
     def save_item(self, item_id, item_name, item_response, update=False):
-        if item_name not in self.item_dict or update:
-            # state
-            self.item_dict[item_name] = {"item":item_name, "item_information":item_response}
-            # file
-            save_dir_path = self.item_path
-            save_file_path = os.path.join(save_dir_path, "items.json")
-            os.makedirs(save_dir_path, exist_ok=True)
-            with open(save_file_path, "a") as f:
-                json.dump([item_name, self.item_dict[item_name]], f)
-                f.write("\n")
-        else:
-            print("Exists and not update")
+        with self.lock:
+            if item_name not in self.item_dict or update:
+                # state and file
+                self.storage.save_item(item_name, {"item":item_name, "item_information":item_response})
+            else:
+                print("Exists and not update")
     
     def save_personality(self, mode, domain, user_id, personality, update=False):
-        if (not self.personality_dict[mode][domain][user_id]) or update:
-            # state
-            self.personality_dict[mode][domain][user_id] = personality
-            # file
-            save_dir_path = os.path.join(self.personality_path, mode, domain)
-            save_file_path = os.path.join(save_dir_path, f"{user_id}.json")
-            os.makedirs(save_dir_path, exist_ok=True)
-            with open(save_file_path, "a") as f:
-                json.dump(personality, f)
-                f.write("\n")
-        else:
-            print("Exists and not update")
+        with self.lock:
+            if (not self.personality_dict[mode][domain][user_id]) or update:
+                self.storage.save_personality(mode, domain, user_id, personality)
+            else:
+                print("Exists and not update")
    
     def save_record(self, r_type, user_id, item_id, action, record, update=False):
-        if (not self.record_dict[r_type][user_id][item_id][action]) or update:
-            # state
-            self.record_dict[r_type][user_id][item_id][action] = record
-
-            # file
-            save_dir_path = self.record_path
-            save_file_path = os.path.join(save_dir_path, f"{user_id}.json")
-            os.makedirs(save_dir_path, exist_ok=True)
-
-            with open(save_file_path, "a") as f:
-                json.dump(record, f) 
-                f.write("\n")
-        else:
-            print("Exists and not update")
+        with self.lock:
+            if (not self.record_dict[r_type][user_id][item_id][action]) or update:
+                self.storage.save_record(r_type, user_id, item_id, action, record)
+            else:
+                print("Exists and not update")
 
-        
+
+def migrate_json_to_sqlite(item_path, record_path, personality_path, db_path, record_types=["learn-act-critic", "act", "learn"]):
+    json_storage = JsonStorage(item_path, record_path, personality_path, record_types)
+    sqlite_storage = SqliteStorage(db_path)
+
+    sqlite_storage.save_many("items", [((name,), item) for name, item in json_storage.item_dict.items()])
+    sqlite_storage.save_many("records", [
+        ((r_type, user_id, item_id, action), record)
+        for r_type, users in json_storage.record_dict.items()
+        for user_id, items in users.items()
+        for item_id, actions in items.items()
+        for action, record in actions.items()
+    ])
+    sqlite_storage.save_many("personalities", [
+        ((mode, domain, user_id), personality)
+        for mode, domains in json_storage.personality_dict.items()
+        for domain, users in domains.items()
+        for user_id, personality in users.items()
+    ])
+    return sqlite_storage
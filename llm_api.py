@@ -1,18 +1,163 @@
 import os
-import openai
-from tqdm import tqdm
-import concurrent.futures
-from concurrent.futures import ThreadPoolExecutor, as_completed
 import time
-import random
+import openai
+import aiohttp
+import asyncio
+import atexit
+import threading
+import functools
+import contextvars
+import metrics
+
+try:
+    import tiktoken     # optional, exact token counts
+except ImportError:
+    tiktoken = None
 
 # openai.api_key = "your key here"
 
-def chatapi(system_prompt, user_prompt, model_name="gpt-4", temperature=0.7):
+MAX_CONNECTIONS = 256     # pooled connections shared by all calls of one event loop
+MAX_RETRY_WAIT = 60       # seconds, cap of the exponential backoff between retries
+
+_sessions = {}            # event loop -> aiohttp.ClientSession
+response_cache = None     # cache.ResponseCache shared by every call, see set_response_cache
+call_stats = {"calls":0, "cache_hits":0}   # per process
+backend = None            # async fn(system_prompt, user_prompt, model_name, temperature, agent) serving calls instead of the API, see set_backend
+trace_recorder = None     # trace.TraceRecorder capturing every exchange, see set_trace_recorder
+_background_loop = None
+_background_lock = threading.Lock()
+_call_timing = contextvars.ContextVar("call_timing", default=None)    # {"queue_wait": seconds} of the call in progress
+
+
+async def on_connection_queued_start(session, trace_ctx, params):
+    trace_ctx.queued = time.time()
+
+async def on_connection_queued_end(session, trace_ctx, params):
+    # time a request waited for a free pooled connection
+    timing = _call_timing.get()
+    if timing is not None:
+        timing["queue_wait"] += time.time() - trace_ctx.queued
+
+def get_session():
+    loop = asyncio.get_running_loop()
+    session = _sessions.get(loop)
+    if session is None or session.closed:
+        connector = aiohttp.TCPConnector(limit=MAX_CONNECTIONS)
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_connection_queued_start.append(on_connection_queued_start)
+        trace_config.on_connection_queued_end.append(on_connection_queued_end)
+        session = aiohttp.ClientSession(connector=connector, trace_configs=[trace_config])
+        _sessions[loop] = session
+    return session
+
+async def close_session():
+    session = _sessions.pop(asyncio.get_running_loop(), None)
+    if session is not None and not session.closed:
+        await session.close()
+
+def get_background_loop():
+    # one event loop in a daemon thread serves every synchronous caller
+    global _background_loop
+    with _background_lock:
+        if _background_loop is None:
+            loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=loop.run_forever, name="llm-api-loop", daemon=True)
+            thread.start()
+            _background_loop = loop
+    return _background_loop
+
+@atexit.register
+def close_background_loop():
+    if _background_loop is not None and _background_loop.is_running():
+        asyncio.run_coroutine_threadsafe(close_session(), _background_loop).result(timeout=5)
+
+def run_sync(coro):
+    loop = get_background_loop()
+    if threading.current_thread().name == "llm-api-loop":
+        coro.close()
+        raise RuntimeError("run_sync can not be called from the llm-api event loop, await the coroutine instead")
+    return asyncio.run_coroutine_threadsafe(coro, loop).result()
+
+
+@functools.lru_cache(maxsize=None)
+def get_encoding(model_name):
+    try:
+        return tiktoken.encoding_for_model(model_name)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+def count_tokens(text, model_name="gpt-4"):
+    if tiktoken is None:
+        return (len(text) + 3) // 4     # ~4 characters per token for English text
+    return len(get_encoding(model_name).encode(text))
+
+
+def estimate_usage(system_prompt, user_prompt, response, model_name="gpt-4"):
+    return {"prompt_tokens":count_tokens(system_prompt, model_name) + count_tokens(user_prompt, model_name),
+            "completion_tokens":count_tokens(response, model_name)}
+
+
+def set_response_cache(cache):
+    global response_cache
+    response_cache = cache
+    return cache
+
+
+def set_backend(fn):
+    global backend
+    backend = fn
+    return fn
+
+def set_trace_recorder(recorder):
+    global trace_recorder
+    trace_recorder = recorder
+    return recorder
+
+def record_exchange(agent, model_name, temperature, system_prompt, user_prompt, response, start, stream=False, cached=False):
+    if trace_recorder is not None:
+        trace_recorder.record_call(agent, model_name, temperature, system_prompt, user_prompt, response,
+                                   start, time.time() - start, stream=stream, cached=cached)
+
+async def abackend_call(system_prompt, user_prompt, model_name, temperature, agent, submitted, start, stream=False):
+    response = await backend(system_prompt, user_prompt, model_name, temperature, agent)
+    observe_usage(agent, model_name, start, submitted, 0, estimate_usage(system_prompt, user_prompt, response, model_name))
+    record_exchange(agent, model_name, temperature, system_prompt, user_prompt, response, start, stream=stream)
+    return response
+
+
+def observe_usage(agent, model_name, start, submitted, retries, usage=None, cache_hit=False):
+    # usage: the "usage" of a completion, None when it is unknown
+    # queue wait: from a sync caller's submit to the start on the event loop, plus waits for a pooled connection
+    usage = usage or {}
+    timing = _call_timing.get() or {"queue_wait":0.0}
+    queue_wait = timing["queue_wait"] + (start - submitted if submitted is not None else 0.0)
+    metrics.observe_call(agent, model_name, time.time() - start,
+                         queue_wait_seconds=queue_wait, retries=retries,
+                         prompt_tokens=usage.get("prompt_tokens", 0), completion_tokens=usage.get("completion_tokens", 0),
+                         cache_hit=cache_hit)
+
+async def achatapi(system_prompt, user_prompt, model_name="gpt-4", temperature=0.7, use_cache=True,
+                   agent=None, submitted=None):
+    # agent: label of the calling agent in metrics; submitted: time.time() when a sync caller queued the call
+    start = time.time()
+    cache = response_cache if use_cache else None
+    if cache is not None:
+        response = cache.get(model_name, temperature, system_prompt, user_prompt)
+        if response is not None:
+            call_stats["cache_hits"] += 1
+            observe_usage(agent, model_name, start, submitted, 0, cache_hit=True)
+            record_exchange(agent, model_name, temperature, system_prompt, user_prompt, response, start, cached=True)
+            return response
+    if backend is not None:
+        return await abackend_call(system_prompt, user_prompt, model_name, temperature, agent, submitted, start)
+
+    openai.aiosession.set(get_session())
+    _call_timing.set({"queue_wait":0.0})
+    call_stats["calls"] += 1
+    retry_wait, retries = 1, 0
     while True:
         try:
-            time.sleep(random.randint(1, 8))  # for concurrent
-            s = openai.ChatCompletion.create(
+            s = await openai.ChatCompletion.acreate(
                 model=model_name,
                 temperature = temperature,
                 messages=[
@@ -20,7 +165,12 @@ def chatapi(system_prompt, user_prompt, model_name="gpt-4", temperature=0.7):
                     {"role": "user", "content": user_prompt},
                 ]
             )
-            return s['choices'][0]['message']['content']
+            response = s['choices'][0]['message']['content']
+            if cache is not None:
+                cache.put(model_name, temperature, system_prompt, user_prompt, response)
+            observe_usage(agent, model_name, start, submitted, retries, s.get('usage'))
+            record_exchange(agent, model_name, temperature, system_prompt, user_prompt, response, start)
+            return response
         except openai.error.Timeout as e:
             #Handle timeout error, e.g. retry or log
             print(f"OpenAI API request timed out: {e}")
@@ -56,5 +206,76 @@ def chatapi(system_prompt, user_prompt, model_name="gpt-4", temperature=0.7):
             print("KeyError")
             pass
 
-    time.sleep(1)
-    return "None"
+        # back off only after a failure, the first attempt goes out immediately
+        retries += 1
+        await asyncio.sleep(retry_wait)
+        retry_wait = min(retry_wait * 2, MAX_RETRY_WAIT)
+
+def chatapi(system_prompt, user_prompt, model_name="gpt-4", temperature=0.7, use_cache=True, agent=None):
+    return run_sync(achatapi(system_prompt, user_prompt, model_name, temperature, use_cache, agent, submitted=time.time()))
+
+
+async def astream_chatapi(system_prompt, user_prompt, model_name="gpt-4", temperature=0.7, use_cache=True,
+                          until=None, keep_rest=False, agent=None, submitted=None):
+    """Stream a completion and return (response, rest) as soon as until(response) is true.
+
+    The stream is cancelled at that point unless keep_rest, then rest is an asyncio.Task that
+    finishes reading it and returns the full text, for logging. Otherwise rest is None.
+    """
+    start = time.time()
+    cache = response_cache if use_cache else None
+    if cache is not None:
+        response = cache.get(model_name, temperature, system_prompt, user_prompt)
+        if response is not None:
+            call_stats["cache_hits"] += 1
+            observe_usage(agent, model_name, start, submitted, 0, cache_hit=True)
+            record_exchange(agent, model_name, temperature, system_prompt, user_prompt, response, start, stream=True, cached=True)
+            return response, None
+    if backend is not None:
+        # the backend answers at once, until() has nothing left to cut
+        return await abackend_call(system_prompt, user_prompt, model_name, temperature, agent, submitted, start, stream=True), None
+
+    openai.aiosession.set(get_session())
+    _call_timing.set({"queue_wait":0.0})
+    call_stats["calls"] += 1
+    retry_wait, retries = 1, 0
+    while True:
+        response = ""
+        try:
+            stream = await openai.ChatCompletion.acreate(
+                model=model_name,
+                temperature = temperature,
+                messages=[
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": user_prompt},
+                ],
+                stream=True
+            )
+            async for chunk in stream:
+                response += chunk['choices'][0]['delta'].get('content') or ""
+                if until is not None and until(response):
+                    # streamed chunks carry no usage, tokens are counted locally up to the decision
+                    observe_usage(agent, model_name, start, submitted, retries, estimate_usage(system_prompt, user_prompt, response, model_name))
+                    record_exchange(agent, model_name, temperature, system_prompt, user_prompt, response, start, stream=True)
+                    if keep_rest:
+                        return response, asyncio.create_task(drain_stream(stream, response, cache, model_name, temperature, system_prompt, user_prompt))
+                    await stream.aclose()       # stop generating, the partial answer is not cached
+                    return response, None
+            if cache is not None:
+                cache.put(model_name, temperature, system_prompt, user_prompt, response)
+            observe_usage(agent, model_name, start, submitted, retries, estimate_usage(system_prompt, user_prompt, response, model_name))
+            record_exchange(agent, model_name, temperature, system_prompt, user_prompt, response, start, stream=True)
+            return response, None
+        except (openai.error.OpenAIError, KeyError) as e:
+            print(f"OpenAI API stream failed: {e!r}")
+
+        retries += 1
+        await asyncio.sleep(retry_wait)
+        retry_wait = min(retry_wait * 2, MAX_RETRY_WAIT)
+
+async def drain_stream(stream, response, cache, model_name, temperature, system_prompt, user_prompt):
+    async for chunk in stream:
+        response += chunk['choices'][0]['delta'].get('content') or ""
+    if cache is not None:
+        cache.put(model_name, temperature, system_prompt, user_prompt, response)
+    return response
@@ -0,0 +1,128 @@
+import json
+import threading
+import contextvars
+
+# In-process metrics of LLM calls, labelled by agent type and model.
+# llm_api records every call (wall time, queue wait, retries, tokens, cache hits) and the agents record
+# whether their response could be parsed, how often a structured response was re-asked and how often
+# a model cascade moved a call up to the next model.
+# `registry` is process wide; an Assistant binds its own registry to `session_registry` so the calls
+# of its operations are also counted per session.
+
+LATENCY_BUCKETS = [0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, float("inf")]
+COUNTERS = ["calls", "cache_hits", "retries", "prompt_tokens", "completion_tokens", "parse_ok", "parse_failed", "repairs", "escalations"]
+TIMERS = ["wall_seconds", "queue_wait_seconds"]
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.series = {}        # (agent, model) -> {"counters":{...}, "timers":{name: {"sum", "max", "buckets"}}}
+
+    def get_series(self, agent, model):
+        # caller holds self.lock
+        key = (agent or "unknown", model or "unknown")
+        if key not in self.series:
+            self.series[key] = {
+                "counters":{name:0 for name in COUNTERS},
+                "timers":{name:{"sum":0.0, "max":0.0, "buckets":[0] * len(LATENCY_BUCKETS)} for name in TIMERS},
+            }
+        return self.series[key]
+
+    def observe_call(self, agent, model, wall_seconds, queue_wait_seconds=0.0, retries=0,
+                     prompt_tokens=0, completion_tokens=0, cache_hit=False):
+        with self.lock:
+            series = self.get_series(agent, model)
+            counters = series["counters"]
+            counters["calls"] += 1
+            counters["cache_hits"] += int(cache_hit)
+            counters["retries"] += retries
+            counters["prompt_tokens"] += prompt_tokens
+            counters["completion_tokens"] += completion_tokens
+            for name, value in (("wall_seconds", wall_seconds), ("queue_wait_seconds", queue_wait_seconds)):
+                timer = series["timers"][name]
+                timer["sum"] += value
+                timer["max"] = max(timer["max"], value)
+                for i, bound in enumerate(LATENCY_BUCKETS):
+                    if value <= bound:
+                        timer["buckets"][i] += 1
+                        break
+
+    def observe_parse(self, agent, model, ok):
+        with self.lock:
+            self.get_series(agent, model)["counters"]["parse_ok" if ok else "parse_failed"] += 1
+
+    def observe_repair(self, agent, model):
+        with self.lock:
+            self.get_series(agent, model)["counters"]["repairs"] += 1
+
+    def observe_escalation(self, agent, model):
+        # model: the tier the call escalated from
+        with self.lock:
+            self.get_series(agent, model)["counters"]["escalations"] += 1
+
+    def reset(self):
+        with self.lock:
+            self.series = {}
+
+    # exporters
+    def summary(self):
+        rows = []
+        with self.lock:
+            for (agent, model), series in sorted(self.series.items()):
+                counters = dict(series["counters"])
+                calls, parsed = counters["calls"], counters["parse_ok"] + counters["parse_failed"]
+                row = {"agent":agent, "model":model, **counters}
+                for name, timer in series["timers"].items():
+                    row[name] = {"sum":timer["sum"], "mean":timer["sum"] / calls if calls else 0.0, "max":timer["max"]}
+                row["parse_success_rate"] = counters["parse_ok"] / parsed if parsed else None
+                rows.append(row)
+        return rows
+
+    def to_json(self, indent=None):
+        return json.dumps(self.summary(), indent=indent)
+
+    def to_prometheus(self, prefix="rah_llm"):
+        lines = []
+        with self.lock:
+            items = sorted(self.series.items())
+            for name in COUNTERS:
+                lines.append(f"# TYPE {prefix}_{name}_total counter")
+                for (agent, model), series in items:
+                    lines.append(f'{prefix}_{name}_total{{agent="{agent}",model="{model}"}} {series["counters"][name]}')
+            for name in TIMERS:
+                lines.append(f"# TYPE {prefix}_{name} histogram")
+                for (agent, model), series in items:
+                    labels = f'agent="{agent}",model="{model}"'
+                    timer, cumulative = series["timers"][name], 0
+                    for bound, count in zip(LATENCY_BUCKETS, timer["buckets"]):
+                        cumulative += count
+                        le = "+Inf" if bound == float("inf") else bound
+                        lines.append(f'{prefix}_{name}_bucket{{{labels},le="{le}"}} {cumulative}')
+                    lines.append(f"{prefix}_{name}_sum{{{labels}}} {timer['sum']}")
+                    lines.append(f"{prefix}_{name}_count{{{labels}}} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+session_registry = contextvars.ContextVar("session_registry", default=None)
+
+def registries():
+    session = session_registry.get()
+    return [registry] if session is None else [registry, session]
+
+def observe_call(agent, model, wall_seconds, **kwargs):
+    for r in registries():
+        r.observe_call(agent, model, wall_seconds, **kwargs)
+
+def observe_parse(agent, model, ok):
+    for r in registries():
+        r.observe_parse(agent, model, ok)
+
+def observe_repair(agent, model):
+    for r in registries():
+        r.observe_repair(agent, model)
+
+def observe_escalation(agent, model):
+    for r in registries():
+        r.observe_escalation(agent, model)
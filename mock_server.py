@@ -0,0 +1,200 @@
+import json
+import time
+import random
+import asyncio
+import argparse
+import threading
+import zlib
+from aiohttp import web
+
+# Local stand-in for the OpenAI chat-completions endpoint, for benchmarks and offline runs.
+# The agent is recognised from its system prompt and answered in the format its postprocess parses.
+# Latency, error rate and a requests/sec rate limit are configurable; stream=True is served as SSE.
+
+WORDS = ["epic", "fantasy", "magic", "space", "opera", "mystery", "detective", "romance", "history", "war",
+         "strategy", "puzzle", "shooter", "horror", "comedy", "family", "music", "science", "biography", "adventure"]
+
+
+class MockConfig:
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, rate_limit=None, accuracy=0.7, seed=0, malformed_rate=0.0):
+        self.latency = latency          # seconds per response
+        self.jitter = jitter            # +- uniform seconds
+        self.error_rate = error_rate    # fraction of requests answered with HTTP 500
+        self.rate_limit = rate_limit    # requests/sec, over it requests get HTTP 429
+        self.accuracy = accuracy        # fraction of critic verdicts that are "True"
+        self.seed = seed
+        self.malformed_rate = malformed_rate    # fraction of structured (JSON) answers cut short
+
+
+def pick(text, choices, salt=""):
+    # deterministic choice per prompt, so repeated prompts get the same answer
+    return choices[zlib.crc32((salt + text).encode("utf-8")) % len(choices)]
+
+def statements(text, salt, n=2):
+    return [f"{pick(text, WORDS, salt + str(i))} {pick(text, WORDS, salt + str(i) + 'b')} stories" for i in range(n)]
+
+def canned_json(system_prompt, user_prompt, config):
+    # structured mode, the JSON object of prompt/<agent>_json.txt
+    if "learn what the user prefer" in system_prompt:
+        data = {"analyze_user_action":"canned", "prefer":statements(user_prompt, "p"), "disprefer":statements(user_prompt, "n")}
+    elif "verify on learned" in system_prompt:
+        accurate = (zlib.crc32(user_prompt.encode("utf-8")) % 1000) / 1000 < config.accuracy
+        data = {"verify":"canned", "accurate":accurate, "reasons":["consistent" if accurate else "prediction conflicts with the action"],
+                "suggestions":["keep" if accurate else "learn more specific preferences"]}
+    elif "reflect on learned" in system_prompt:
+        data = {"reflection":"canned", "prefer":statements(user_prompt, "rp", 3), "disprefer":statements(user_prompt, "rn", 3)}
+    else:
+        data = {"analysis":"canned", "comment":"canned", "action":pick(user_prompt, ["Like", "Dislike"])}
+    return json.dumps(data)
+
+def canned_response(system_prompt, user_prompt, config):
+    if "STRUCTURED RESPONSE FORMAT" in system_prompt:
+        return canned_json(system_prompt, user_prompt, config)
+    if "describe the item" in system_prompt:
+        return (f"Type: {pick(user_prompt, ['book', 'movie', 'game'])}\n"
+                f"Description: a {pick(user_prompt, WORDS)} {pick(user_prompt, WORDS, 'd')} title\n"
+                f"Characteristic: {', '.join(statements(user_prompt, 'c', 3))}")
+    if "learn what the user prefer" in system_prompt:
+        prefer = "\n".join(f"$$ prefer: {s}" for s in statements(user_prompt, "p"))
+        disprefer = "\n".join(f"$$ disprefer: {s}" for s in statements(user_prompt, "n"))
+        return (f"Analyze Why like: canned\nAnalyze Why dislike: canned\nAnalyze user action:: canned\n"
+                f"Learned prefer: \n{prefer}\n\nLearned disprefer:\n{disprefer}\n")
+    if "verify on learned" in system_prompt:
+        accurate = (zlib.crc32(user_prompt.encode("utf-8")) % 1000) / 1000 < config.accuracy
+        if accurate:
+            return "Verify: canned\nAccurate: True\nReasons:\n$$ reason: consistent\nSuggest: \n$$ suggestion: keep\n"
+        return ("Verify: canned\nAccurate: False\nReasons:\n$$ reason: prediction conflicts with the action\n"
+                "Suggest: \n$$ suggestion: learn more specific preferences\n")
+    if "reflect on learned" in system_prompt:
+        prefer = "\n".join(f"$$ prefer: {s}" for s in statements(user_prompt, "rp", 3))
+        disprefer = "\n".join(f"$$ disprefer: {s}" for s in statements(user_prompt, "rn", 3))
+        return (f"Reflection: canned\nNeed optimize prefer: no\nNeed optimize disprefer: no\n"
+                f"How to optimize prefer: -\nHow to optimize disprefer: -\n"
+                f"Optimized User Prefer: \n{prefer}\nOptimized User Disprefer:\n{disprefer}\n")
+    if "one line per item" in system_prompt:
+        n_items = user_prompt.count("] Item:")
+        return "\n".join(f"[{i}] User Action: {pick(user_prompt, ['Like', 'Dislike'], str(i))} | Score: {pick(user_prompt, list(range(11)), str(i))}"
+                         for i in range(1, n_items + 1))
+    return (f"Guess Like: canned\nGuess Dislike: canned\nAnalysis: canned\nUser Comment: canned\n"
+            f"User Action: {pick(user_prompt, ['Like', 'Dislike'])}\n")
+
+
+class MockServer:
+    def __init__(self, config=None, host="127.0.0.1", port=0):
+        self.config = config or MockConfig()
+        self.host = host
+        self.port = port
+        self.random = random.Random(self.config.seed)
+        self.stats = {"requests":0, "errors":0, "rate_limited":0, "streams":0}
+        self.window = []                # request times of the last second, for the rate limit
+        self.loop = None
+        self.runner = None
+
+    def over_rate_limit(self):
+        if not self.config.rate_limit:
+            return False
+        now = time.time()
+        self.window = [t for t in self.window if now - t < 1.0]
+        if len(self.window) >= self.config.rate_limit:
+            return True
+        self.window.append(now)
+        return False
+
+    async def chat_completions(self, request):
+        self.stats["requests"] += 1
+        if self.over_rate_limit():
+            self.stats["rate_limited"] += 1
+            return web.json_response({"error":{"message":"Rate limit reached", "type":"requests"}}, status=429)
+        body = await request.json()
+        delay = max(self.config.latency + self.random.uniform(-self.config.jitter, self.config.jitter), 0.0)
+        await asyncio.sleep(delay)
+        if self.random.random() < self.config.error_rate:
+            self.stats["errors"] += 1
+            return web.json_response({"error":{"message":"Mock server error", "type":"server_error"}}, status=500)
+
+        messages = body["messages"]
+        system_prompt, user_prompt = messages[0]["content"], messages[-1]["content"]
+        content = canned_response(system_prompt, user_prompt, self.config)
+        if "STRUCTURED RESPONSE FORMAT" in system_prompt and self.random.random() < self.config.malformed_rate:
+            content = content[:len(content) // 2]
+        usage = {"prompt_tokens":(len(system_prompt) + len(user_prompt)) // 4, "completion_tokens":len(content) // 4}
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        if body.get("stream"):
+            self.stats["streams"] += 1
+            return await self.stream(request, body, content)
+        return web.json_response({
+            "id":"mock", "object":"chat.completion", "created":int(time.time()), "model":body.get("model"),
+            "choices":[{"index":0, "message":{"role":"assistant", "content":content}, "finish_reason":"stop"}],
+            "usage":usage,
+        })
+
+    async def stream(self, request, body, content):
+        response = web.StreamResponse(headers={"Content-Type":"text/event-stream"})
+        await response.prepare(request)
+        for token in content.split(" "):
+            chunk = {"id":"mock", "object":"chat.completion.chunk", "model":body.get("model"),
+                     "choices":[{"index":0, "delta":{"content":token + " "}, "finish_reason":None}]}
+            await response.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            await asyncio.sleep(0)
+        await response.write(b"data: [DONE]\n\n")
+        return response
+
+    async def get_stats(self, request):
+        return web.json_response(self.stats)
+
+    def make_app(self):
+        app = web.Application()
+        app.router.add_post("/v1/chat/completions", self.chat_completions)
+        app.router.add_get("/stats", self.get_stats)
+        return app
+
+    async def start_async(self):
+        self.runner = web.AppRunner(self.make_app())
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, self.host, self.port)
+        await site.start()
+        self.port = self.runner.addresses[0][1]     # resolved when port=0
+        return self.url
+
+    def start(self):
+        # serve from a daemon thread, returns the api base url
+        self.loop = asyncio.new_event_loop()
+        thread = threading.Thread(target=self.loop.run_forever, name="mock-llm-server", daemon=True)
+        thread.start()
+        return asyncio.run_coroutine_threadsafe(self.start_async(), self.loop).result()
+
+    def stop(self):
+        if self.loop is not None:
+            asyncio.run_coroutine_threadsafe(self.runner.cleanup(), self.loop).result()
+            self.loop.call_soon_threadsafe(self.loop.stop)
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}/v1"
+
+
+def use_mock_server(url, api_key="mock"):
+    # point llm_api (openai 0.28) at the mock server
+    import openai
+    openai.api_base = url
+    openai.api_key = api_key
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local mock of the chat-completions endpoint")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--error_rate", type=float, default=0.0)
+    parser.add_argument("--rate_limit", type=float, default=None, help="requests/sec, then HTTP 429")
+    parser.add_argument("--accuracy", type=float, default=0.7, help="fraction of critic verdicts that are True")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--malformed_rate", type=float, default=0.0, help="fraction of JSON answers cut short")
+    args = parser.parse_args(argv)
+
+    config = MockConfig(args.latency, args.jitter, args.error_rate, args.rate_limit, args.accuracy, args.seed, args.malformed_rate)
+    server = MockServer(config, args.host, args.port)
+    web.run_app(server.make_app(), host=args.host, port=args.port)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+import os
+import sys
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from agents import get_agents, parse_tiers
+from assistant import Assistant
+from library import Library
+from utils import SCORE_MAP, make_name
+from cache import ResponseCache
+import llm_api
+import metrics
+
+# Sharded, resumable evaluation over Library.history_dict:
+# every user learns from its "learn" split (all domains) and then acts on its "unseen" split.
+
+def make_step_items(history, domain):
+    return [
+        {
+            "item_id":h["asin"],
+            "item_name":make_name(h["title"], domain),
+            "user_action":SCORE_MAP[h["overall"]],
+            "user_comment":h["reviewText"]
+        }
+        for h in history
+    ]
+
+def shard_users(user_ids, num_shards):
+    shards = [[] for _ in range(num_shards)]
+    for index, user_id in enumerate(sorted(user_ids)):
+        shards[index % num_shards].append(user_id)
+    return shards
+
+def get_library(args, shard_index):
+    paths = [os.path.join(args.library_dir, name) for name in ["item", "record", "personality"]]
+    for path in paths:
+        os.makedirs(path, exist_ok=True)
+    return Library(
+        *paths,
+        args.history_dir,
+        record_types=["learn-act-critic", "act"],
+        item_file=f"items-shard{shard_index:03d}.json",
+        backend=args.backend,
+        lazy=args.lazy,
+        flush_interval=args.flush_interval,
+        fsync=args.fsync
+    )
+
+def run_user(assistant, library, user_id, domains, args, out_file):
+    history = library.history_dict[user_id]
+    domains = domains or sorted(history["learn"].keys())
+    if args.prefetch:
+        assistant.prefetch(user_id, domains=domains, concurrency=args.prefetch)    # describe items ahead of learn/act
+
+    # 1. learn, already learned (user, item, action) are reused from record_dict
+    for domain in domains:
+        items = make_step_items(history["learn"].get(domain, []), domain)
+        assistant.learn_batch(items, concurrency=args.concurrency, update=True, max_try_times=args.max_try_times,
+                              speculative=args.speculative)
+
+    # 2. act on unseen
+    for domain in domains:
+        for item in make_step_items(history["unseen"].get(domain, []), domain):
+            if library.record_dict["act"][user_id][item["item_id"]][item["user_action"]]:
+                continue    # written to the shard file before the restart
+            one_record = assistant.act(item["item_id"], item["item_name"], user_action=item["user_action"], log=False)
+            result = {
+                "user_id":user_id, "domain":domain,
+                "item_id":item["item_id"], "item_name":item["item_name"],
+                "user_action":item["user_action"],
+                "assistant_action":one_record["result"]["assistant_action"],
+                "accurate":one_record["result"]["accurate"]
+            }
+            out_file.write(json.dumps(result) + "\n")
+            out_file.flush()
+
+def run_shard(shard_index, user_ids, args):
+    if args.cache_path:
+        # one connection per worker process, the shards share the cache file
+        llm_api.set_response_cache(ResponseCache(args.cache_path, max_age=args.max_age, fresh_sampling=args.fresh_sampling))
+    library = get_library(args, shard_index)
+    agents = get_agents(prompt_dir=args.prompt_dir, structured=args.structured, tiers=parse_tiers(args.cascade))
+    os.makedirs(args.output_dir, exist_ok=True)
+    out_path = os.path.join(args.output_dir, f"shard-{shard_index:03d}.jsonl")
+
+    start = time.time()
+    critic = {"calls":0, "skipped":0}
+    cascade = {"steps":0, "escalated":0}
+    with open(out_path, "a") as out_file:
+        for done, user_id in enumerate(user_ids, start=1):
+            assistant = Assistant(*agents, user_id, library, personality_top_k=args.personality_top_k)
+            run_user(assistant, library, user_id, args.domains, args, out_file)
+            for key in critic:
+                critic[key] += assistant.metrics["critic"][key]
+            for key in cascade:
+                cascade[key] += assistant.metrics["cascade"][key]
+            with open(os.path.join(args.output_dir, f"sessions-shard{shard_index:03d}.jsonl"), "a") as f:
+                f.write(json.dumps(assistant.session_summary()) + "\n")
+
+            minutes = max(time.time() - start, 1e-6) / 60
+            print(f"[shard {shard_index}] {done}/{len(user_ids)} users | "
+                  f"{done / minutes:.2f} users/min | {llm_api.call_stats['calls'] / minutes:.1f} calls/min | "
+                  f"{llm_api.call_stats['cache_hits']} cache hits | "
+                  f"{critic['skipped'] / max(critic['calls'] + critic['skipped'], 1):.0%} critic calls skipped | "
+                  f"{cascade['escalated'] / max(cascade['steps'], 1):.0%} steps escalated", flush=True)
+
+    library.flush()
+    # per agent/model latency, tokens, retries and parse success of this shard
+    with open(os.path.join(args.output_dir, f"metrics-shard{shard_index:03d}.json"), "w") as f:
+        f.write(metrics.registry.to_json(indent=2))
+    with open(os.path.join(args.output_dir, f"metrics-shard{shard_index:03d}.prom"), "w") as f:
+        f.write(metrics.registry.to_prometheus())
+    return {"shard":shard_index, "users":len(user_ids), "calls":llm_api.call_stats["calls"], "seconds":time.time() - start,
+            "records_per_sec":library.write_stats().get("records_per_sec", 0.0)}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Sharded multi-user learn/act evaluation")
+    parser.add_argument("--history_dir", default="./examples")
+    parser.add_argument("--library_dir", default="./library")
+    parser.add_argument("--prompt_dir", default="./prompt")
+    parser.add_argument("--output_dir", default="./output")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--shards", type=int, default=None, help="defaults to --workers")
+    parser.add_argument("--concurrency", type=int, default=4, help="learn items in flight per worker")
+    parser.add_argument("--max_try_times", type=int, default=2)
+    parser.add_argument("--speculative", type=int, default=None, help="learn-act-critic chains started at once per item")
+    parser.add_argument("--personality_top_k", type=int, default=None, help="prefer/disprefer statements per act prompt")
+    parser.add_argument("--prefetch", type=int, default=0, help="items described in the background at once, 0 disables")
+    parser.add_argument("--structured", action="store_true", help="agents answer with validated JSON objects")
+    parser.add_argument("--cascade", nargs="*", default=None, metavar="AGENT=MODEL,MODEL",
+                        help="model tiers per agent, cheapest first, e.g. action=gpt-3.5-turbo,gpt-4-0613 (all=... for every agent)")
+    parser.add_argument("--max_users", type=int, default=None)
+    parser.add_argument("--domains", nargs="*", default=None)
+    parser.add_argument("--backend", default="json", choices=["json", "sqlite"], help="Library storage backend")
+    parser.add_argument("--lazy", action="store_true", help="load each user's library data on first access")
+    parser.add_argument("--flush_interval", type=float, default=None, help="group-commit library writes every N seconds")
+    parser.add_argument("--fsync", default="never", choices=["never", "commit"], help="fsync policy of library writes")
+    parser.add_argument("--cache_path", default=None, help="on-disk LLM response cache, e.g. ./library/cache.sqlite")
+    parser.add_argument("--max_age", type=float, default=None, help="seconds a cached response stays valid")
+    parser.add_argument("--fresh_sampling", action="store_true", help="do not cache temperature>0 calls")
+    args = parser.parse_args(argv)
+    if args.cache_path and not args.fresh_sampling:
+        print(f"Response cache {args.cache_path}: sampled (temperature>0) calls are replayed too, "
+              f"pass --fresh_sampling to sample them again", flush=True)
+
+    user_ids = sorted(filter(lambda x: x[0]=="A", os.listdir(args.history_dir)))
+    if args.max_users:
+        user_ids = user_ids[:args.max_users]
+    shards = shard_users(user_ids, args.shards or args.workers)
+
+    start = time.time()
+    total_users, total_calls = 0, 0
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        futures = [executor.submit(run_shard, index, shard, args) for index, shard in enumerate(shards) if shard]
+        for future in as_completed(futures):
+            result = future.result()
+            total_users += result["users"]
+            total_calls += result["calls"]
+            minutes = max(time.time() - start, 1e-6) / 60
+            print(f"[shard {result['shard']} done] {total_users}/{len(user_ids)} users | "
+                  f"{total_users / minutes:.2f} users/min | {total_calls / minutes:.1f} calls/min", flush=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+import re
+import zlib
+import numpy as np
+
+# Offline text similarity for personality statements: signed feature hashing of words and word
+# bigrams into a fixed-size vector, cosine search with NumPy. No model download, no network.
+
+DIM = 1024
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+STOP_WORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "in", "is", "it", "its", "of", "on", "or",
+    "that", "the", "this", "to", "with", "user", "users", "prefer", "prefers", "disprefer", "disprefers",
+    "like", "likes", "dislike", "dislikes", "item", "items",
+}
+# near-duplicate detection also ignores the other verbs a statement may be phrased with
+DEDUP_STOP_WORDS = STOP_WORDS | {"enjoy", "enjoys", "love", "loves", "hate", "hates"}
+
+def tokenize(text, stop_words=STOP_WORDS):
+    return [token for token in TOKEN_PATTERN.findall(str(text).lower()) if token not in stop_words]
+
+def embed(text, dim=DIM):
+    vector = np.zeros(dim, dtype=np.float32)
+    tokens = tokenize(text)
+    for feature in tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]:
+        h = zlib.crc32(feature.encode("utf-8"))
+        vector[h % dim] += -1.0 if h & 0x80000000 else 1.0     # sign bit keeps collisions unbiased
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
+
+
+class StatementIndex:
+    """Embeddings of a list of statements, re-synced incrementally as the list changes"""
+
+    def __init__(self, dim=DIM):
+        self.dim = dim
+        self.vectors = {}           # statement -> embedding, kept across syncs
+        self.statements = []
+        self.matrix = np.zeros((0, dim), dtype=np.float32)
+
+    def sync(self, statements):
+        # only statements not seen before are embedded
+        if statements == self.statements:
+            return
+        for statement in statements:
+            if statement not in self.vectors:
+                self.vectors[statement] = embed(statement, self.dim)
+        live = set(statements)
+        for statement in [s for s in self.vectors if s not in live]:
+            del self.vectors[statement]
+        self.statements = list(statements)
+        self.matrix = np.stack([self.vectors[s] for s in statements]) if statements else np.zeros((0, self.dim), dtype=np.float32)
+
+    def scores(self, query):
+        return self.matrix @ embed(query, self.dim)
+
+    def top_k(self, query, k):
+        # the k most similar statements, in their original order
+        if k is None or len(self.statements) <= k:
+            return list(self.statements)
+        if k <= 0:
+            return []
+        selected = np.argpartition(-self.scores(query), k - 1)[:k]
+        return [self.statements[i] for i in sorted(selected)]
+
+
+# near-duplicate detection: MinHash signatures over character shingles of the normalized words,
+# the fraction of equal signature slots estimates the Jaccard similarity of two statements
+
+NUM_PERM = 64
+SHINGLE_SIZE = 4
+MERSENNE_PRIME = (1 << 61) - 1
+_rng = np.random.RandomState(1)
+PERM_A = _rng.randint(1, 1 << 31, NUM_PERM).astype(np.uint64)
+PERM_B = _rng.randint(0, 1 << 31, NUM_PERM).astype(np.uint64)
+
+def shingles(text, size=SHINGLE_SIZE):
+    normalized = " ".join(tokenize(text, DEDUP_STOP_WORDS))
+    if len(normalized) <= size:
+        return {normalized}
+    return {normalized[i:i+size] for i in range(len(normalized) - size + 1)}
+
+def minhash(text):
+    hashes = np.array([zlib.crc32(s.encode("utf-8")) for s in shingles(text)], dtype=np.uint64)
+    # (a*h + b) mod p for every permutation at once, h < 2^32 and a < 2^31 keep it inside uint64
+    return ((np.outer(hashes, PERM_A) + PERM_B) % MERSENNE_PRIME).min(axis=0)
+
+def dedup_statements(statements, existing=(), threshold=0.7):
+    """Split statements into (kept, removed): removed ones restate an existing or an earlier kept statement"""
+    signatures = [minhash(s) for s in existing]
+    kept, removed = [], []
+    for statement in statements:
+        signature = minhash(statement)
+        if signatures and (np.stack(signatures) == signature).mean(axis=1).max() >= threshold:
+            removed.append(statement)
+            continue
+        kept.append(statement)
+        signatures.append(signature)
+    return kept, removed
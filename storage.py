@@ -0,0 +1,141 @@
+import os
+import json
+import sqlite3
+import threading
+
+# SQLite backend for Library: one file, rows are fetched on access instead of loading the corpus.
+# Key columns are TEXT, a None key (e.g. the action of an "act" record without groundtruth) is stored as "".
+
+TABLES = {
+    "items": ["name"],
+    "records": ["type", "user_id", "item_id", "action"],
+    "personalities": ["mode", "domain", "user_id"],
+}
+
+def encode_key(key):
+    return "" if key is None else str(key)
+
+
+class NestedView:
+    """Read-only nested mapping over one table, behaves like Library's deep_defaultdict"""
+
+    def __init__(self, storage, table, prefix=()):
+        self.storage = storage
+        self.table = table
+        self.prefix = prefix
+        self.key_names = TABLES[table]
+
+    def __getitem__(self, key):
+        prefix = self.prefix + (encode_key(key),)
+        if len(prefix) < len(self.key_names):
+            return NestedView(self.storage, self.table, prefix)
+        value = self.storage.get(self.table, prefix)
+        return {} if value is None else value   # missing leaf is falsy, as with deep_defaultdict
+
+    def get(self, key, default=None):
+        if key in self:
+            return self[key]
+        return default
+
+    def __contains__(self, key):
+        return self.storage.exists(self.table, self.prefix + (encode_key(key),))
+
+    def __bool__(self):
+        return len(self.prefix) == 0 or self.storage.exists(self.table, self.prefix)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def keys(self):
+        return self.storage.child_keys(self.table, self.prefix)
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+    def values(self):
+        return [self[key] for key in self.keys()]
+
+
+class SqliteStorage:
+    def __init__(self, db_path):
+        self.db_path = db_path
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None, timeout=60)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        for table, key_names in TABLES.items():
+            columns = ", ".join(f"{name} TEXT NOT NULL" for name in key_names)
+            self.conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {table} ({columns}, data TEXT, PRIMARY KEY ({', '.join(key_names)}))"
+            )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS records_user ON records(user_id)")
+
+        self.item_dict = NestedView(self, "items")                 # item_name
+        self.record_dict = NestedView(self, "records")             # type/user_id/item_id/action/
+        self.personality_dict = NestedView(self, "personalities")  # mode/domain/user_id
+
+    # query
+    def where(self, table, prefix):
+        key_names = TABLES[table][:len(prefix)]
+        return " AND ".join(f"{name}=?" for name in key_names) or "1"
+
+    def get(self, table, key):
+        with self.lock:
+            row = self.conn.execute(f"SELECT data FROM {table} WHERE {self.where(table, key)}", key).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def exists(self, table, prefix):
+        with self.lock:
+            row = self.conn.execute(f"SELECT 1 FROM {table} WHERE {self.where(table, prefix)} LIMIT 1", prefix).fetchone()
+        return row is not None
+
+    def child_keys(self, table, prefix):
+        name = TABLES[table][len(prefix)]
+        with self.lock:
+            rows = self.conn.execute(f"SELECT DISTINCT {name} FROM {table} WHERE {self.where(table, prefix)}", prefix).fetchall()
+        return [row[0] for row in rows]
+
+    def put(self, table, key, value):
+        key = tuple(encode_key(k) for k in key)
+        placeholders = ", ".join("?" * (len(key) + 1))
+        with self.lock:
+            self.conn.execute(f"INSERT OR REPLACE INTO {table} VALUES ({placeholders})", key + (json.dumps(value),))
+
+    # same contract as library.JsonStorage
+    def save_item(self, item_name, item):
+        self.put("items", (item_name,), item)
+
+    def save_record(self, r_type, user_id, item_id, action, record):
+        self.put("records", (r_type, user_id, item_id, action), record)
+
+    def save_personality(self, mode, domain, user_id, personality):
+        self.put("personalities", (mode, domain, user_id), personality)
+
+    def save_many(self, table, rows):
+        # rows: [(key tuple, value)], one transaction for bulk imports
+        with self.lock:
+            self.conn.execute("BEGIN")
+            for key, value in rows:
+                self.put(table, key, value)
+            self.conn.execute("COMMIT")
+
+    def read_item(self, item_name):
+        return self.get("items", (encode_key(item_name),))
+
+    def read_record(self, r_type, user_id, item_id, action):
+        return self.get("records", tuple(encode_key(k) for k in (r_type, user_id, item_id, action)))
+
+    def compact(self, lock=None):
+        with self.lock:
+            self.conn.execute("VACUUM")
+        return {}
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,307 @@
+import os
+import gzip
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import threading
+import functools
+import contextvars
+import numpy as np
+import llm_api
+from collections import defaultdict, deque
+from agents import get_agents, parse_tiers, AGENT_NAMES
+from assistant import Assistant
+from library import Library
+from llm_api import run_sync
+
+# Capture of a real session into a gzip JSON-lines trace, and time-scaled replay of it offline.
+# A trace holds one line per LLM exchange (agent, model, prompts, response, latency, start offset) and
+# one line per top-level Assistant operation (user, op, arguments, start offset). System prompts are
+# stored once and referenced by id. The agent config (structured prompt suffixes) is recorded with the
+# header or the first attached assistant, so replay rebuilds the same prompts. Replay re-runs the operations against a fresh Library with the
+# recorded responses served through llm_api.set_backend, at the recorded pace divided by `speed`.
+
+TRACE_VERSION = 1
+TRACED_OPS = ["adescribe_item", "aact", "astep_learn_act_critic", "areflect", "arank", "alearn_batch"]
+
+_op_depth = contextvars.ContextVar("trace_op_depth", default=0)    # >0 inside a traced operation
+_op_id = contextvars.ContextVar("trace_op_id", default=None)
+
+
+def agent_config(agents):
+    # agents in get_agents order; what replay needs to render the recorded system prompts again
+    return {"structured":{name:agent.structured_prompt for name, agent in zip(AGENT_NAMES, agents) if agent.structured},
+            "tiers":{name:list(agent.tiers) for name, agent in zip(AGENT_NAMES, agents)}}
+
+def build_agents(prompt_dir, config=None, tiers=None):
+    # get_agents with the recorded structured suffixes, verbatim even if prompt/<agent>_json.txt changed since,
+    # and the recorded model tiers unless tiers overrides them
+    config = config or {}
+    structured = config.get("structured") or {}
+    agents = get_agents(prompt_dir, structured=bool(structured), tiers=tiers or config.get("tiers"))
+    for name, agent in zip(AGENT_NAMES, agents):
+        agent.structured_prompt = structured.get(name)
+        agent.structured = agent.structured_prompt is not None
+    return agents
+
+def assistant_agents(assistant):
+    return (assistant.perceive_agent, assistant.learn_agent, assistant.action_agent, assistant.reflect_agent, assistant.critic_agent)
+
+def is_jsonable(value):
+    # agent objects passed as overrides are not recorded, replay uses its own agents
+    try:
+        json.dumps(value)
+        return True
+    except TypeError:
+        return False
+
+
+class TraceRecorder:
+    def __init__(self, path, agents=None):
+        # agents: the agents of the session, otherwise taken from the first attached assistant
+        self.path = path
+        self.lock = threading.Lock()
+        self.file = gzip.open(path, "wt", encoding="utf-8")
+        self.start = time.time()
+        self.prompt_ids = {}        # system prompt -> id
+        self.n_ops = 0
+        self.n_calls = 0
+        self.agent_config = agent_config(agents) if agents is not None else None
+        self.write({"type":"header", "version":TRACE_VERSION, "start":self.start, "agents":self.agent_config})
+
+    def write(self, line):
+        # caller holds self.lock, except in __init__
+        self.file.write(json.dumps(line) + "\n")
+
+    def prompt_id(self, text):
+        # caller holds self.lock
+        if text not in self.prompt_ids:
+            self.prompt_ids[text] = len(self.prompt_ids)
+            self.write({"type":"prompt", "id":self.prompt_ids[text], "text":text})
+        return self.prompt_ids[text]
+
+    def record_call(self, agent, model_name, temperature, system_prompt, user_prompt, response, start, latency,
+                    stream=False, cached=False):
+        with self.lock:
+            if self.file.closed:
+                return
+            self.n_calls += 1
+            self.write({"type":"call", "t":start - self.start, "latency":latency, "agent":agent, "model":model_name,
+                        "temperature":temperature, "system":self.prompt_id(system_prompt), "user":user_prompt,
+                        "response":response, "stream":stream, "cached":cached, "op":_op_id.get()})
+
+    def record_op(self, user_id, op, args, kwargs):
+        with self.lock:
+            self.n_ops += 1
+            op_id = self.n_ops
+            self.write({"type":"op", "id":op_id, "t":time.time() - self.start, "user_id":user_id, "op":op,
+                        "args":list(args), "kwargs":{key:value for key, value in kwargs.items() if is_jsonable(value)}})
+        return op_id
+
+    def record_assistant(self, assistant):
+        # personality at the time the assistant is attached, replay starts from it
+        with self.lock:
+            self.write({"type":"assistant", "t":time.time() - self.start, "user_id":assistant.user_id,
+                        "prefer":list(assistant.prefer), "disprefer":list(assistant.disprefer),
+                        "local_critic":assistant.local_critic, "personality_top_k":assistant.personality_top_k})
+
+    def attach(self, assistant):
+        """Record the top-level operations of assistant, nested ones (e.g. describe_item inside act) are not recorded"""
+        if self.agent_config is None:
+            with self.lock:
+                self.agent_config = agent_config(assistant_agents(assistant))
+                self.write({"type":"agents", "config":self.agent_config})
+        self.record_assistant(assistant)
+        for op in TRACED_OPS:
+            setattr(assistant, op, self.traced(assistant, op, getattr(assistant, op)))
+        return assistant
+
+    def traced(self, assistant, op, method):
+        @functools.wraps(method)
+        async def wrapper(*args, **kwargs):
+            depth = _op_depth.get()
+            token = _op_depth.set(depth + 1)
+            op_token = _op_id.set(self.record_op(assistant.user_id, op, args, kwargs) if depth == 0 else _op_id.get())
+            try:
+                return await method(*args, **kwargs)
+            finally:
+                _op_id.reset(op_token)
+                _op_depth.reset(token)
+        return wrapper
+
+    def close(self):
+        with self.lock:
+            if not self.file.closed:
+                self.file.close()
+
+    def __enter__(self):
+        llm_api.set_trace_recorder(self)
+        return self
+
+    def __exit__(self, *exc):
+        llm_api.set_trace_recorder(None)
+        self.close()
+
+
+def start_trace(path):
+    # capture every exchange of this process until stop_trace
+    return llm_api.set_trace_recorder(TraceRecorder(path))
+
+def stop_trace():
+    if llm_api.trace_recorder is not None:
+        llm_api.trace_recorder.close()
+    llm_api.set_trace_recorder(None)
+
+
+def load_trace(path):
+    prompts, calls, ops, assistants, config = {}, [], [], {}, None
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            if entry["type"] == "header":
+                config = entry.get("agents")
+            elif entry["type"] == "agents" and config is None:
+                config = entry["config"]
+            elif entry["type"] == "prompt":
+                prompts[entry["id"]] = entry["text"]
+            elif entry["type"] == "call":
+                entry["system"] = prompts[entry["system"]]
+                calls.append(entry)
+            elif entry["type"] == "op":
+                ops.append(entry)
+            elif entry["type"] == "assistant":
+                assistants.setdefault(entry["user_id"], entry)     # first state of each user
+    return {"calls":calls, "ops":ops, "assistants":assistants, "agents":config or {}}
+
+
+class ReplayBackend:
+    """Serves recorded responses to llm_api, keyed by the exact exchange.
+
+    A prompt that is not in the trace (e.g. a changed prompt template) gets the next unused response
+    of the same agent, in trace order, and is counted in misses.
+    """
+
+    def __init__(self, calls, speed=1.0):
+        self.speed = speed              # 0 answers at once, otherwise recorded latency / speed
+        self.exact = defaultdict(deque)
+        self.by_agent = defaultdict(deque)
+        for call in calls:
+            self.exact[self.key(call["system"], call["user"], call["model"], call["temperature"])].append(call)
+            self.by_agent[call["agent"]].append(call)
+        self.stats = {"calls":0, "hits":0, "misses":0, "empty":0}
+
+    @staticmethod
+    def key(system_prompt, user_prompt, model_name, temperature):
+        return (model_name, float(temperature), system_prompt, user_prompt)
+
+    async def __call__(self, system_prompt, user_prompt, model_name, temperature, agent=None):
+        self.stats["calls"] += 1
+        queue = self.exact.get(self.key(system_prompt, user_prompt, model_name, temperature))
+        if queue:
+            self.stats["hits"] += 1
+            call = queue.popleft() if len(queue) > 1 else queue[0]     # repeated prompts get their recorded answers in order
+        else:
+            self.stats["misses"] += 1
+            queue = self.by_agent.get(agent)
+            if not queue:
+                self.stats["empty"] += 1
+                return ""
+            call = queue[0]
+            queue.rotate(-1)
+        if self.speed and not call["cached"]:
+            await asyncio.sleep(call["latency"] / self.speed)
+        return call["response"]
+
+
+def percentiles(latencies):
+    latencies = np.array(latencies) if latencies else np.zeros(1)
+    return {"p50":float(np.percentile(latencies, 50)), "p95":float(np.percentile(latencies, 95)), "max":float(latencies.max())}
+
+async def areplay(trace, agents, library, speed=1.0, assistant_kwargs=None):
+    # ops of one user run in recorded order; an op starts at its recorded offset / speed (speed=0: as soon as possible)
+    assistants = {}
+    for user_id in {op["user_id"] for op in trace["ops"]}:
+        state = trace["assistants"].get(user_id, {})
+        kwargs = {"local_critic":state.get("local_critic", True), "personality_top_k":state.get("personality_top_k")}
+        kwargs.update(assistant_kwargs or {})
+        assistant = Assistant(*agents, user_id, library, **kwargs)
+        assistant.set_personality(state.get("prefer", []), state.get("disprefer", []))
+        assistants[user_id] = assistant
+
+    by_user = defaultdict(list)
+    for op in sorted(trace["ops"], key=lambda op: op["t"]):
+        by_user[op["user_id"]].append(op)
+
+    start = time.time()
+    latencies = defaultdict(list)
+    lag = []        # how late ops started against the scaled schedule
+
+    async def run_user(user_id, ops):
+        for op in ops:
+            if speed:
+                delay = op["t"] / speed - (time.time() - start)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                lag.append(max(-delay, 0.0))
+            op_start = time.time()
+            await getattr(assistants[user_id], op["op"])(*op["args"], **op["kwargs"])
+            latencies[op["op"]].append(time.time() - op_start)
+
+    await asyncio.gather(*[run_user(user_id, ops) for user_id, ops in by_user.items()])
+    seconds = time.time() - start
+    return {
+        "seconds":seconds, "ops":sum(len(v) for v in latencies.values()),
+        "ops_per_sec":sum(len(v) for v in latencies.values()) / seconds if seconds > 0 else 0.0,
+        "latency":{op:percentiles(v) for op, v in latencies.items()},
+        "schedule_lag":percentiles(lag) if lag else None,
+    }
+
+def replay(path, prompt_dir="./prompt", history_dir="./examples", library_dir=None, speed=1.0, tiers=None, **library_kwargs):
+    """Replay a trace against a fresh Library; returns op throughput/latency and backend hit stats
+
+    tiers: model cascade of the replayed agents, defaults to the recorded one
+    """
+    trace = load_trace(path)
+    backend = ReplayBackend(trace["calls"], speed)
+    library_dir = library_dir or tempfile.mkdtemp(prefix="rah-replay-")
+    paths = [os.path.join(library_dir, name) for name in ["item", "record", "personality"]]
+    for p in paths:
+        os.makedirs(p, exist_ok=True)
+    library = Library(*paths, history_dir, record_types=["learn-act-critic", "act"], **library_kwargs)
+
+    previous = llm_api.backend
+    llm_api.set_backend(backend)
+    try:
+        result = run_sync(areplay(trace, build_agents(prompt_dir, trace["agents"], tiers), library, speed))
+    finally:
+        llm_api.set_backend(previous)
+        library.flush()
+    recorded = max([op["t"] for op in trace["ops"]] + [call["t"] + call["latency"] for call in trace["calls"]] + [0.0])
+    result.update({"speed":speed, "recorded_seconds":recorded, "backend":backend.stats, "library_dir":library_dir,
+                   "write_stats":library.write_stats()})
+    return result
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay a captured trace offline")
+    parser.add_argument("trace")
+    parser.add_argument("--speed", type=float, default=1.0, help="1 = recorded pace, 10 = ten times faster, 0 = as fast as possible")
+    parser.add_argument("--prompt_dir", default="./prompt")
+    parser.add_argument("--history_dir", default="./examples")
+    parser.add_argument("--library_dir", default=None, help="defaults to a temporary directory")
+    parser.add_argument("--backend", default="json", choices=["json", "sqlite"])
+    parser.add_argument("--flush_interval", type=float, default=None)
+    parser.add_argument("--fsync", default="never", choices=["never", "commit"])
+    parser.add_argument("--cascade", nargs="*", default=None, metavar="AGENT=MODEL,MODEL",
+                        help="model tiers per agent, defaults to the ones recorded in the trace")
+    args = parser.parse_args(argv)
+
+    result = replay(args.trace, args.prompt_dir, args.history_dir, args.library_dir, args.speed, parse_tiers(args.cascade),
+                    backend=args.backend, flush_interval=args.flush_interval, fsync=args.fsync)
+    print(json.dumps(result, indent=2))
+
+if __name__ == "__main__":
+    main()
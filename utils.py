@@ -11,74 +11,148 @@ def read_json_lines(file_path):
             data.append(json.loads(line))
     return data
 
-def read_reviews(data_dir, domains):
+# columnar cache: <domain>.parquet / meta_<domain>.parquet next to the CSVs, built once by build_columnar_cache
+CATEGORICAL_COLUMNS = ["reviewerID", "asin"]
+
+def has_parquet():
+    try:
+        import pyarrow
+        return True
+    except ImportError:
+        return False
+
+def optimize_dtypes(df):
+    for column in CATEGORICAL_COLUMNS:
+        if column in df:
+            df[column] = df[column].astype("category")
+    for column in df.select_dtypes(include="integer").columns:
+        df[column] = pd.to_numeric(df[column], downcast="integer")
+    for column in df.select_dtypes(include="float").columns:
+        df[column] = pd.to_numeric(df[column], downcast="float")
+    return df
+
+def build_columnar_cache(data_dir, domains, overwrite=False):
+    if not has_parquet():
+        raise ImportError("build_columnar_cache needs pyarrow")
+    for domain in domains:
+        for name in [domain, f"meta_{domain}"]:
+            csv_path = os.path.join(data_dir, f"{name}.csv")
+            parquet_path = os.path.join(data_dir, f"{name}.parquet")
+            if os.path.exists(parquet_path) and not overwrite:
+                continue
+            df = optimize_dtypes(pd.read_csv(csv_path))
+            df.to_parquet(parquet_path + ".tmp", engine="pyarrow", index=False)
+            os.replace(parquet_path + ".tmp", parquet_path)
+
+def read_table(data_dir, name, columns=None, use_cache=True):
+    # columns: only these columns are read, the parquet cache is used when it exists
+    parquet_path = os.path.join(data_dir, f"{name}.parquet")
+    if use_cache and os.path.exists(parquet_path) and has_parquet():
+        return pd.read_parquet(parquet_path, columns=columns, engine="pyarrow", memory_map=True)
+    return pd.read_csv(os.path.join(data_dir, f"{name}.csv"), usecols=columns)
+
+# overall,verified,reviewTime,reviewerID,asin,style,reviewerName,reviewText,summary,unixReviewTime,vote,image
+USEFUL_COLUMNS = ["reviewerID", "reviewerName", "reviewTime", "asin", "title", "overall", "reviewText", "description"]
+# projections for read_reviews / read_metas, the defaults cover USEFUL_COLUMNS (columns=None reads everything)
+REVIEW_COLUMNS = ["reviewerID", "reviewerName", "reviewTime", "asin", "overall", "reviewText"]   # get_one_user / get_users
+META_COLUMNS = ["asin", "title", "description"]
+SCORE_REVIEW_COLUMNS = ["reviewerID", "asin", "overall"]                                         # find_strict_users / find_tradeoff_users
+SCORE_META_COLUMNS = ["asin", "title"]
+
+def read_reviews(data_dir, domains, columns=REVIEW_COLUMNS, use_cache=True):
     reviews = [] 
     for domain in domains:
-        review_path = os.path.join(data_dir, f"{domain}.csv")
-        review = pd.read_csv(review_path)
+        review = read_table(data_dir, domain, columns, use_cache)
         reviews.append(review)
     return reviews
 
-def read_metas(data_dir, domains):
+def read_metas(data_dir, domains, columns=META_COLUMNS, use_cache=True):
     metas = []
     for domain in domains:
-        meta_path = os.path.join(data_dir, f"meta_{domain}.csv")
-        meta = pd.read_csv(meta_path)
+        meta = read_table(data_dir, f"meta_{domain}", columns, use_cache)
         metas.append(meta)
     return metas
 
+def pad_domain_list(domain_list, review_list):
+    if len(domain_list)<len(review_list):
+        domain_list = domain_list + ["default"] * (len(review_list) - len(domain_list))
+    return domain_list
+
+def merge_history(selected_review, meta, domain, useful_columns=USEFUL_COLUMNS):
+    selected_meta = meta.loc[meta['asin'].isin(selected_review["asin"])]
+    result = pd.merge(selected_review, selected_meta, left_on="asin", right_on="asin").loc[:, useful_columns]
+    result = result.drop_duplicates(subset=["reviewerID", "title"])
+    if "reviewTime" in result:
+        result["reviewTime"] = pd.to_datetime(result["reviewTime"])
+        result = result.sort_values("reviewTime", kind="stable")
+    result["domain"] = domain
+    return result
+
 def get_one_user(reviewerID, review_list = [], meta_list = [], domain_list=[]):
 
     result_list = []
-    if len(domain_list)<len(review_list):
-        domain_list = domain_list + ["default"] * (len(review_list) - len(domain_list))
+    domain_list = pad_domain_list(domain_list, review_list)
     for review, meta, domain in zip(review_list, meta_list, domain_list):
         selected_review = review.loc[review["reviewerID"]==reviewerID]
-        selected_meta = meta.loc[meta['asin'].isin(review["asin"])]
-        # overall,verified,reviewTime,reviewerID,asin,style,reviewerName,reviewText,summary,unixReviewTime,vote,image
-        useful_columns = ["reviewerID", "reviewerName", "reviewTime", "asin", "title", "overall", "reviewText", "description"]
-        result = pd.merge(selected_review, selected_meta, left_on="asin", right_on="asin").loc[:, useful_columns]
-        result = result.drop_duplicates(subset=["reviewerID", "title"])
-        result["reviewTime"] = pd.to_datetime(result["reviewTime"])
-        result = result.sort_values("reviewTime")
-        result["domain"] = domain
-
+        result = merge_history(selected_review, meta, domain)
         result_list.append(result)
     
     return result_list
 
+def get_users(reviewer_ids, review_list = [], meta_list = [], domain_list=[]):
+    """get_one_user for many users with one merge per domain, returns {reviewerID: [history per domain]}"""
+    reviewer_ids = list(reviewer_ids)
+    domain_list = pad_domain_list(domain_list, review_list)
+    histories = {reviewer_id: [] for reviewer_id in reviewer_ids}
+    for review, meta, domain in zip(review_list, meta_list, domain_list):
+        selected_review = review.loc[review["reviewerID"].isin(reviewer_ids)]
+        result = merge_history(selected_review, meta, domain)
+        groups = dict(tuple(result.groupby("reviewerID", sort=False, observed=True)))
+        for reviewer_id in reviewer_ids:
+            histories[reviewer_id].append(groups.get(reviewer_id, result.iloc[0:0]))
+    return histories
+
+def count_user_scores(users, reviews, metas):
+    """Per domain, a users x overall table of how many (deduplicated) items each user rated with each score"""
+    users = list(users)
+    score_counts = []
+    for review, meta in zip(reviews, metas):
+        selected_review = review.loc[review["reviewerID"].isin(users), SCORE_REVIEW_COLUMNS]
+        history = merge_history(selected_review, meta.loc[:, SCORE_META_COLUMNS], None, ["reviewerID", "asin", "title", "overall"])
+        counts = history.groupby(["reviewerID", "overall"], observed=True).size().unstack(fill_value=0)
+        score_counts.append(counts.reindex(users, fill_value=0))
+    return score_counts
+
+def sum_scores(counts, scores):
+    columns = [score for score in counts.columns if score in scores]
+    return counts.loc[:, columns].sum(axis=1)
+
 def find_strict_users(users, reviews, metas, strict_level=3):
 
-    # strict user
-    strict_users = []
-    for user_id in tqdm(users):
-        strict = True
-        history = get_one_user(user_id, reviews, metas)
-        for h in history:
-            score_count = dict(h["overall"].value_counts())
-            if h.loc[h["overall"]<=2].shape[0] < strict_level:
-                strict = False
-                break
-        
-        if strict:
-            strict_users.append(user_id)
-    return strict_users
+    # strict user: at least strict_level dislikes (overall<=2) in every domain
+    users = list(users)
+    strict = pd.Series(True, index=list(dict.fromkeys(users)))
+    for counts in count_user_scores(strict.index, reviews, metas):
+        dislike_columns = [score for score in counts.columns if score<=2]
+        strict &= counts.loc[:, dislike_columns].sum(axis=1) >= strict_level
+    return [user_id for user_id in users if strict[user_id]]
 
 def find_tradeoff_users(users, reviews, metas):
 
     # tradeoff user
+    users = list(users)
+    unique_users = list(dict.fromkeys(users))
+    dislike_cnt = pd.Series(0, index=unique_users)
+    like_cnt = pd.Series(0, index=unique_users)
+    for counts in count_user_scores(unique_users, reviews, metas):
+        dislike_cnt += sum_scores(counts, [1, 2])
+        like_cnt += sum_scores(counts, [4, 5])
+
     tradeoff_users = []
-    for user_id in tqdm(users):
-        history = get_one_user(user_id, reviews, metas)
-        dislike_cnt = 0
-        like_cnt = 0
-        for h in history:
-            score_count = dict(h["overall"].value_counts())
-            dislike_cnt += score_count.get(1, 0) + score_count.get(2, 0)
-            like_cnt += score_count.get(4, 0) + score_count.get(5, 0)
-
-        if dislike_cnt > 0 and like_cnt > 0:
-            tradeoff_users.append((user_id, min(dislike_cnt,like_cnt)/max(like_cnt,dislike_cnt)))
+    for user_id in users:
+        dislike, like = int(dislike_cnt[user_id]), int(like_cnt[user_id])
+        if dislike > 0 and like > 0:
+            tradeoff_users.append((user_id, min(dislike,like)/max(like,dislike)))
         else:
             tradeoff_users.append((user_id, 0))
             